@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+画廊构建基准测试
+生成指定规模的合成画廊，测量 GalleryBuilder 各环节的耗时，输出 JSON 结果并可与基线比较
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from build_gallery import GalleryBuilder, BuildProfiler, Image
+
+RESULTS_VERSION = 1
+SHAPE_FILENAME = '.benchmark-shape.json'
+PROJECT_DIR = Path(__file__).resolve().parent
+
+
+def parse_size(text):
+    """解析文件大小，支持 K/M/G 后缀（如 200K、1.5M）"""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+class SyntheticGallery:
+    """
+    合成画廊生成器
+    按 相册数 × 每相册文件数 × 文件大小 × 视频比例 生成可复现的目录结构（相同 seed 生成相同内容）；
+    图片是真实的 JPEG（后面补齐随机字节到目标大小，解码器会忽略），视频只是占位字节
+    """
+
+    def __init__(self, root, albums=20, files=50, file_size=200 * 1024, video_ratio=0.1, image_size=(1600, 1200), seed=0):
+        self.root = Path(root)
+        self.shape = {
+            'albums': albums,
+            'files': files,
+            'file_size': file_size,
+            'video_ratio': video_ratio,
+            'image_size': list(image_size),
+            'seed': seed,
+        }
+
+    @property
+    def total_files(self):
+        return self.shape['albums'] * self.shape['files']
+
+    def is_current(self):
+        """目录中已有相同规格的合成画廊时直接复用，避免大规模画廊每次都重新生成"""
+        try:
+            with open(self.root / SHAPE_FILENAME, 'r', encoding='utf-8') as f:
+                return json.load(f) == self.shape
+        except (OSError, ValueError):
+            return False
+
+    def make_image(self, rng):
+        """生成一张带随机色块的 JPEG，使缩略图和转码的耗时接近真实照片"""
+        width, height = self.shape['image_size']
+        if Image is None:
+            return b''
+        image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        for _ in range(8):
+            x, y = rng.randrange(width), rng.randrange(height)
+            box = (x, y, min(width, x + rng.randrange(1, width // 2)), min(height, y + rng.randrange(1, height // 2)))
+            image.paste(tuple(rng.randrange(256) for _ in range(3)), box)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        return buffer.getvalue()
+
+    def generate(self):
+        """生成画廊，返回是否实际生成（False 表示复用了已有目录）"""
+        if self.is_current():
+            return False
+        if self.root.exists():
+            shutil.rmtree(self.root)
+        self.root.mkdir(parents=True)
+
+        rng = random.Random(self.shape['seed'])
+        # 预先生成少量不同的图片，按文件轮流使用，避免生成大画廊时大部分时间花在编码上
+        images = [self.make_image(rng) for _ in range(8)]
+        file_size = self.shape['file_size']
+
+        for album_index in range(self.shape['albums']):
+            album_dir = self.root / f"{album_index + 1:03d}-Album {album_index + 1}"
+            album_dir.mkdir()
+            for file_index in range(self.shape['files']):
+                if rng.random() < self.shape['video_ratio']:
+                    path = album_dir / f"video_{file_index:05d}.mp4"
+                    data = b''
+                else:
+                    path = album_dir / f"image_{file_index:05d}.jpg"
+                    data = images[(album_index + file_index) % len(images)]
+                # 每个文件的填充内容不同，保证内容哈希互不相同
+                padding = max(0, file_size - len(data))
+                with open(path, 'wb') as f:
+                    f.write(data)
+                    # Random.randbytes 需要 Python 3.9，按 getrandbits 生成以兼容 3.8
+                    count = min(padding, 64)
+                    f.write(rng.getrandbits(8 * count).to_bytes(count, 'little') if count else b'')
+                    if padding > 64:
+                        f.write(bytes(padding - 64))
+
+        with open(self.root / SHAPE_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump(self.shape, f)
+        return True
+
+    def touch_album(self, index=0):
+        """修改一个相册中所有文件的修改时间，模拟增量构建时的少量变化"""
+        album_dir = sorted(path for path in self.root.iterdir() if path.is_dir())[index]
+        now = time.time()
+        count = 0
+        for path in album_dir.iterdir():
+            os.utime(path, (now, now))
+            count += 1
+        return album_dir.name, count
+
+
+class GalleryBenchmark:
+    """
+    对合成画廊依次测量：scan_gallery、copy_media_files、冷构建、should_rebuild、无变化构建、增量构建
+    构建过程的输出默认被屏蔽；每次构建都记录 BuildProfiler 的分阶段数据
+    """
+
+    def __init__(self, gallery, workdir, repeat=3, overrides=None, verbose=False):
+        self.gallery = gallery
+        self.workdir = Path(workdir)
+        self.repeat = max(1, repeat)
+        self.verbose = verbose
+        self.output_dir = self.workdir / 'output'
+        self.config_path = self.workdir / 'config.json'
+
+        config = {
+            'input': str(gallery.root),
+            'output': str(self.output_dir),
+            'title': 'Benchmark Gallery',
+        }
+        config.update(overrides or {})
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        self.results = {}
+
+    @contextlib.contextmanager
+    def quiet(self):
+        if self.verbose:
+            yield
+            return
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+    def make_builder(self, profiler=None, output_dir=None):
+        with self.quiet():
+            builder = GalleryBuilder(str(self.config_path), profiler=profiler)
+        if output_dir is not None:
+            builder.output_dir = Path(output_dir)
+        return builder
+
+    def record(self, name, runs, files, **extra):
+        result = {
+            'seconds': round(statistics.median(runs), 4),
+            'min_seconds': round(min(runs), 4),
+            'runs': [round(run, 4) for run in runs],
+            'files': files,
+        }
+        if files and result['seconds'] > 0:
+            result['files_per_second'] = round(files / result['seconds'], 1)
+        result.update(extra)
+        self.results[name] = result
+        print(f"   {name:<16} {result['seconds']:>9.3f}秒  (最快 {result['min_seconds']:.3f}秒, 文件 {files})")
+
+    def time_call(self, func):
+        start = time.perf_counter()
+        with self.quiet():
+            value = func()
+        return time.perf_counter() - start, value
+
+    def bench_scan(self):
+        runs = []
+        for _ in range(self.repeat):
+            seconds, albums = self.time_call(self.make_builder().scan_gallery)
+            runs.append(seconds)
+        self.record('scan', runs, sum(len(album['media']) for album in albums), albums=len(albums))
+
+    def bench_copy(self):
+        """只测量媒体发布：每次都发布到空的独立目录"""
+        copy_dir = self.workdir / 'copy-output'
+        runs = []
+        for _ in range(self.repeat):
+            if copy_dir.exists():
+                shutil.rmtree(copy_dir)
+            builder = self.make_builder(output_dir=copy_dir)
+            with self.quiet():
+                albums = builder.scan_gallery()
+            seconds, copied = self.time_call(lambda: builder.copy_media_files(albums))
+            runs.append(seconds)
+        shutil.rmtree(copy_dir, ignore_errors=True)
+        self.record('copy', runs, copied, mode=builder.media_publish)
+
+    def run_build(self):
+        profiler = BuildProfiler(enabled=True)
+        builder = self.make_builder(profiler=profiler)
+        seconds, _ = self.time_call(builder.build)
+        return seconds, profiler.phases
+
+    def bench_builds(self):
+        total = self.gallery.total_files
+
+        # 冷构建：没有输出目录和构建清单
+        if self.output_dir.exists():
+            shutil.rmtree(self.output_dir)
+        seconds, phases = self.run_build()
+        self.record('cold_build', [seconds], total, phases=phases)
+
+        runs = []
+        for _ in range(self.repeat):
+            seconds, _ = self.time_call(self.make_builder().should_rebuild)
+            runs.append(seconds)
+        self.record('should_rebuild', runs, total)
+
+        runs = []
+        for _ in range(self.repeat):
+            seconds, phases = self.run_build()
+            runs.append(seconds)
+        self.record('noop_build', runs, total)
+
+        # 增量构建：每轮修改一个相册，其余相册沿用上次的输出
+        runs = []
+        for i in range(self.repeat):
+            album_name, touched = self.gallery.touch_album(i % self.gallery.shape['albums'])
+            seconds, phases = self.run_build()
+            runs.append(seconds)
+        self.record('warm_build', runs, total, touched_files=touched, phases=phases)
+
+    def run(self, scenarios):
+        # 主题文件按相对路径读取，需要在项目目录中运行构建
+        os.chdir(PROJECT_DIR)
+        if 'scan' in scenarios:
+            self.bench_scan()
+        if 'copy' in scenarios:
+            self.bench_copy()
+        if 'build' in scenarios:
+            self.bench_builds()
+        return self.results
+
+    def report(self):
+        try:
+            import PIL
+            pillow_version = PIL.__version__
+        except ImportError:
+            pillow_version = None
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return {
+            'version': RESULTS_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'pillow': pillow_version,
+            },
+            'shape': self.gallery.shape,
+            'config': {key: value for key, value in config.items() if key not in ('input', 'output')},
+            'results': self.results,
+        }
+
+
+def compare_results(results, baseline, tolerance):
+    """与基线比较，返回超出 (1 + tolerance) 倍基线耗时的项目列表"""
+    if baseline.get('shape') != results.get('shape'):
+        print("⚠️  警告: 基线的画廊规格与本次不同，比较结果仅供参考")
+
+    regressions = []
+    print(f"📊 与基线比较（容差 {tolerance:.0%}）:")
+    for name, result in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else 1.0
+        status = '✅'
+        if ratio > 1 + tolerance:
+            status = '❌'
+            regressions.append(name)
+        print(f"   {status} {name:<16} {previous['seconds']:>9.3f}秒 -> {result['seconds']:>9.3f}秒  ({ratio:.2f}x)")
+    return regressions
+
+
+def check_limits(results, limits):
+    """检查绝对耗时上限（如 warm_build=30），返回超出上限的项目列表"""
+    failures = []
+    for name, limit in limits.items():
+        result = results['results'].get(name)
+        if result is None:
+            print(f"⚠️  警告: 没有 {name} 的测量结果，忽略上限")
+            continue
+        if result['seconds'] > limit:
+            print(f"   ❌ {name}: {result['seconds']:.3f}秒 超过上限 {limit}秒")
+            failures.append(name)
+        else:
+            print(f"   ✅ {name}: {result['seconds']:.3f}秒 未超过上限 {limit}秒")
+    return failures
+
+
+def parse_assignments(values, convert):
+    """解析重复出现的 key=value 参数"""
+    result = {}
+    for value in values or []:
+        key, sep, raw = value.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"参数格式应为 key=value: {value}")
+        result[key] = convert(raw)
+    return result
+
+
+def json_value(raw):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='画廊构建基准测试')
+    parser.add_argument('--albums', type=int, default=20, help='相册数量（默认: 20）')
+    parser.add_argument('--files', type=int, default=50, help='每个相册的文件数（默认: 50）')
+    parser.add_argument('--file-size', type=parse_size, default='200K', help='每个文件的大小，支持 K/M/G（默认: 200K）')
+    parser.add_argument('--video-ratio', type=float, default=0.1, help='视频文件比例（默认: 0.1）')
+    parser.add_argument('--image-size', default='1600x1200', help='合成图片尺寸（默认: 1600x1200）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子（默认: 0）')
+    parser.add_argument('--workdir', help='工作目录，保留以便复用合成画廊（默认: 临时目录，结束后删除）')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，结果取中位数（默认: 3）')
+    parser.add_argument('--scenarios', default='scan,copy,build', help='要运行的项目（默认: scan,copy,build）')
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE',
+                        help='覆盖构建配置，值按 JSON 解析（如 --set thumbnail-widths=[] --set media-publish=hardlink）')
+    parser.add_argument('--output', help='结果 JSON 输出路径')
+    parser.add_argument('--baseline', help='基线结果 JSON，耗时超出容差时返回非零退出码')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='与基线比较的容差（默认: 0.2，即慢 20%%）')
+    parser.add_argument('--max', action='append', metavar='NAME=SECONDS',
+                        help='耗时上限（如 --max warm_build=30），超过时返回非零退出码')
+    parser.add_argument('--verbose', action='store_true', help='显示构建过程的输出')
+    args = parser.parse_args(argv)
+
+    width, _, height = args.image_size.lower().partition('x')
+    overrides = parse_assignments(args.set, json_value)
+    limits = parse_assignments(args.max, float)
+    scenarios = {name.strip() for name in args.scenarios.split(',') if name.strip()}
+    # 构建在项目目录中运行，先把命令行中的相对路径解析为绝对路径
+    output_path = Path(args.output).resolve() if args.output else None
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix='gallery-bench-'))
+    try:
+        gallery = SyntheticGallery(workdir / 'gallery', albums=args.albums, files=args.files, file_size=args.file_size,
+                                   video_ratio=args.video_ratio, image_size=(int(width), int(height)), seed=args.seed)
+        print(f"🧪 合成画廊: {args.albums} 个相册 × {args.files} 个文件 = {gallery.total_files} 个文件")
+        start = time.perf_counter()
+        if gallery.generate():
+            print(f"   已生成，耗时: {time.perf_counter() - start:.2f}秒")
+        else:
+            print("   复用已有的合成画廊")
+
+        print("⏱️  运行基准测试...")
+        benchmark = GalleryBenchmark(gallery, workdir, repeat=args.repeat, overrides=overrides, verbose=args.verbose)
+        benchmark.run(scenarios)
+        results = benchmark.report()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"📈 结果已写入: {output_path}")
+
+    failures = []
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            failures += compare_results(results, json.load(f), args.tolerance)
+    if limits:
+        failures += check_limits(results, limits)
+    if failures:
+        print(f"❌ 基准测试未通过: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
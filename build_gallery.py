@@ -6,325 +6,947 @@
 
 import json
 import shutil
+import base64
+import io
 import re
 from pathlib import Path
 from datetime import datetime
 import urllib.parse
 import hashlib
-import base64
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import gzip
+import errno
+import subprocess
+import argparse
+import platform
+import sys
+import functools
+import importlib
+import http.server
+from contextlib import contextmanager, nullcontext
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
-class GalleryBuilder:
-    def __init__(self, config_path="config.json"):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = json.load(f)
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持 reflink
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只生成 .gz 预压缩文件
+    brotli = None
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 未安装 watchdog 时监视模式改为轮询
+    Observer = None
+    FileSystemEventHandler = None
+
+try:
+    from fontTools import subset as fonttools_subset
+except ImportError:  # 未安装 fonttools 时不裁剪字体
+    fonttools_subset = None
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # 未安装 Pillow 时跳过所有图像处理步骤
+    Image = None
+    ImageFilter = None
+    ImageOps = None
+
+# 支持的媒体扩展名
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.mkv', '.m4v'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
+
+# 媒体发布方式，失败时依次回退到下一种方式
+MEDIA_PUBLISH_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+# Linux FICLONE ioctl，用于在 Btrfs/XFS 等文件系统上创建写时复制副本
+FICLONE = 0x40049409
+
+# 需要生成 .gz/.br 预压缩副本的文本文件
+PRECOMPRESS_EXTENSIONS = {'.html', '.css', '.js', '.json', '.svg', '.xml', '.txt'}
+PRECOMPRESS_SUFFIXES = ('.gz', '.br')
+
+# 扫描输入目录时始终跳过的目录
+EXCLUDED_DIR_NAMES = {'__pycache__', 'node_modules'}
+
+# 可以由 Pillow 解码并生成缩略图的图片格式（GIF 保留动画、SVG 为矢量，直接使用原图）
+THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff'}
+
+# 可以读取尺寸和 EXIF 的图片格式
+METADATA_EXTENSIONS = THUMBNAIL_EXTENSIONS | {'.gif'}
+
+# EXIF 标签：方向、修改时间、EXIF 子目录、拍摄时间
+EXIF_MAKE = 271
+EXIF_MODEL = 272
+EXIF_ORIENTATION = 274
+EXIF_DATETIME = 306
+EXIF_IFD = 34665
+EXIF_DATETIME_ORIGINAL = 36867
+
+
+def read_image_metadata(src_path):
+    """
+    只读取图片文件头和 EXIF，不解码像素数据
+    返回 {'width': 宽, 'height': 高, 'taken': 拍摄时间 ISO 字符串或 None, 'orientation': EXIF 方向, 'camera': 相机型号或 None}，
+    宽高已按 EXIF 方向校正为显示尺寸
+    """
+    with Image.open(src_path) as img:
+        width, height = img.size
+        exif = img.getexif()
+        taken = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    
+    # 型号中通常已包含厂商名（如 Canon EOS R5），不重复添加
+    make = str(exif.get(EXIF_MAKE) or '').strip('\x00 ')
+    model = str(exif.get(EXIF_MODEL) or '').strip('\x00 ')
+    camera = model if model.lower().startswith(make.lower()) else f"{make} {model}".strip()
+
+    orientation = exif.get(EXIF_ORIENTATION, 1)
+    if orientation in (5, 6, 7, 8):
+        # 旋转 90 度的方向，显示时宽高互换
+        width, height = height, width
+
+    try:
+        taken = datetime.strptime(str(taken).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat() if taken else None
+    except ValueError:
+        taken = None
+    return {'width': width, 'height': height, 'taken': taken, 'orientation': orientation, 'camera': camera or None}
+
+
+def render_thumbnails(src_path, dest_dir, widths, quality, name=None):
+    """
+    解码原图并生成多种宽度的 JPEG 缩略图（在子进程中运行）
+    缩略图命名为 <name>_<宽>.jpg（name 默认为原图文件名），
+    只生成小于原图宽度的尺寸，返回 [(宽, 高, 文件名), ...]（按宽度升序）
+    """
+    src_path = Path(src_path)
+    name = name or src_path.name
+    dest_dir = Path(dest_dir)
+    widths = sorted(widths, reverse=True)
+
+    with Image.open(src_path) as img:
+        # JPEG 可以直接按较小比例解码，大幅减少解码耗时和内存
+        img.draft('RGB', (widths[0], widths[0]))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            # JPEG 不支持透明通道，铺白色背景
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+
+        results = []
+        for width in widths:
+            if width >= img.width:
+                continue
+            height = max(1, round(img.height * width / img.width))
+            # 从上一级尺寸继续缩小，避免每次都从原图重采样
+            img = img.resize((width, height), Image.LANCZOS)
+            filename = f'{name}_{width}.jpg'
+            img.save(dest_dir / filename, 'JPEG', quality=quality, optimize=True, progressive=True)
+            results.append((width, height, filename))
+
+    results.reverse()
+    return results
+
+
+# 现代图片格式：配置名 -> (Pillow 格式名, 扩展名, MIME 类型)，按浏览器优先顺序排列
+TRANSCODE_FORMATS = {
+    'avif': ('AVIF', '.avif', 'image/avif'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+
+
+def get_supported_transcode_formats():
+    """返回当前 Pillow 能够编码的现代图片格式（AVIF 需要 Pillow 11.2+ 或 pillow-avif-plugin）"""
+    if Image is None:
+        return set()
+    try:
+        # 导入即注册 AVIF 插件
+        importlib.import_module('pillow_avif')
+    except ImportError:
+        pass
+    Image.init()
+    return {name for name, (pil_format, _, _) in TRANSCODE_FORMATS.items() if pil_format in Image.SAVE}
+
+
+def transcode_image(src_path, dest_dir, formats, quality, known_hash=None):
+    """
+    把原图转码为 WebP/AVIF 等现代格式（在子进程中运行）
+    输出文件名包含源文件内容哈希，已存在的结果直接复用，文件内容不变就不会重新编码
+    返回 (内容哈希, [(格式名, 文件名), ...])
+    """
+    src_path = Path(src_path)
+    dest_dir = Path(dest_dir)
+    content_hash = known_hash or hash_file(src_path)
+    
+    outputs = []
+    pending = []
+    for name in formats:
+        pil_format, extension, _ = TRANSCODE_FORMATS[name]
+        filename = f'{src_path.stem}.{content_hash[:12]}{extension}'
+        outputs.append((name, filename))
+        if not (dest_dir / filename).exists():
+            pending.append((pil_format, filename))
+    
+    if pending:
+        with Image.open(src_path) as img:
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+            for pil_format, filename in pending:
+                # 先写入临时文件，避免中断时留下不完整的结果被当作缓存
+                tmp_path = dest_dir / f'.{filename}.tmp'
+                img.save(tmp_path, pil_format, quality=quality)
+                os.replace(tmp_path, dest_dir / filename)
+    
+    return content_hash, outputs
+
+
+def render_placeholder(src_path, size, quality=40, known_hash=None):
+    """
+    生成内联到卡片背景中的低质量模糊占位图（在子进程中运行）
+    缩小到最长边 size 像素并轻微模糊后编码为 WebP，通常只有几百字节
+    返回 (内容哈希, data: URI)
+    """
+    content_hash = known_hash or hash_file(src_path)
+    with Image.open(src_path) as img:
+        img.draft('RGB', (size * 8, size * 8))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            # 透明区域铺白色背景，与卡片底色一致
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        img.thumbnail((size, size), Image.LANCZOS)
+        img = img.filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        img.save(buffer, 'WEBP', quality=quality)
+    return content_hash, 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def perceptual_hash(src_path, size=8):
+    """
+    计算图片的差值哈希（dHash，在子进程中运行），返回 16 位十六进制字符串
+    缩小为 (size+1)×size 的灰度图后比较相邻像素，内容相近的图片哈希的汉明距离很小
+    """
+    with Image.open(src_path) as img:
+        img.draft('L', (size * 8, size * 8))
+        img = ImageOps.exif_transpose(img).convert('L').resize((size + 1, size), Image.LANCZOS)
+        pixels = img.tobytes()
+
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:0{size * size // 4}x}'
+
+
+def find_similar_pairs(hashes, threshold):
+    """
+    找出汉明距离不超过 threshold 的感知哈希对，hashes 为 {键: 十六进制哈希}
+    把 64 位哈希分成 threshold+1 段，距离不超过阈值的两个哈希至少有一段完全相同（抽屉原理），
+    只比较有相同分段的候选，避免两两比较
+    """
+    bands = threshold + 1
+    width = 64 // bands
+    buckets = {}
+    for key, value in hashes.items():
+        bits = int(value, 16)
+        for band in range(bands):
+            segment = (bits >> (band * width)) & ((1 << width) - 1)
+            buckets.setdefault((band, segment), []).append((key, bits))
+
+    pairs = {}
+    for members in buckets.values():
+        for i, (key_a, bits_a) in enumerate(members):
+            for key_b, bits_b in members[i + 1:]:
+                pair = tuple(sorted((key_a, key_b)))
+                if pair not in pairs:
+                    distance = bin(bits_a ^ bits_b).count('1')
+                    if distance <= threshold:
+                        pairs[pair] = distance
+    return sorted((a, b, distance) for (a, b), distance in pairs.items())
+
+
+def subset_font(src_path, dest_path, text):
+    """用 fontTools 把字体裁剪为只包含 text 中的字符，并保存为 WOFF2（在子进程中运行）"""
+    options = fonttools_subset.Options()
+    options.flavor = 'woff2'
+    font = fonttools_subset.load_font(str(src_path), options)
+    subsetter = fonttools_subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    # 先写入临时文件，避免中断时留下不完整的结果被当作缓存
+    tmp_path = f"{dest_path}.tmp"
+    fonttools_subset.save_font(font, tmp_path, options)
+    font.close()
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def convert_font(src_path, dest_path):
+    """
+    不裁剪，把完整字体保存到 dest_path（裁剪失败时使用），样式表和页面中的字体地址保持可用
+    优先转换为 WOFF2；转换也失败时直接复制原字体，浏览器按文件内容识别字体格式
+    """
+    tmp_path = f"{dest_path}.tmp"
+    try:
+        options = fonttools_subset.Options()
+        options.flavor = 'woff2'
+        font = fonttools_subset.load_font(str(src_path), options)
+        fonttools_subset.save_font(font, tmp_path, options)
+        font.close()
+    except Exception:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def tokenize_search_text(text):
+    """把文本切分为搜索词，忽略单个字母或数字"""
+    return [
+        token for token in SEARCH_TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 or re.match(f"[{SEARCH_CJK_CHARS}]", token)
+    ]
+
+
+def get_search_shard_key(token):
+    """搜索词所在的分片：按前两个字符（中日韩文字为单字）分片，浏览器只需加载查询词对应的分片"""
+    return token[:2]
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """计算文件内容的 SHA-256 哈希"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file_contents(method, src_path, dest_path, progress=None, chunk_size=8 * 1024 * 1024):
+    """
+    用指定方式复制文件内容：copy_file_range 和 sendfile 在内核中完成复制，不经过用户态缓冲区
+    （copy_file_range 在 NFS 4.2 等文件系统上还可以由服务器端完成）；userspace 为普通读写
+    每复制一段调用 progress(字节数)，返回复制的字节数
+    """
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        while True:
+            if method == 'copy_file_range':
+                count = os.copy_file_range(src.fileno(), dest.fileno(), chunk_size)
+            elif method == 'sendfile':
+                count = os.sendfile(dest.fileno(), src.fileno(), copied, chunk_size)
+            else:
+                data = src.read(chunk_size)
+                dest.write(data)
+                count = len(data)
+            if count == 0:
+                break
+            copied += count
+            if progress:
+                progress(count)
+        # 部分文件系统不支持时直接返回 0 而不报错
+        if copied == 0 and size > 0:
+            raise OSError(errno.ENOSYS, f"{method} 未复制任何数据")
+    shutil.copystat(src_path, dest_path)
+    return copied
+
+
+class CopyEngine:
+    """
+    媒体文件复制引擎：优先使用 copy_file_range，其次 sendfile，都不支持时回退为普通读写
+    大文件的并发数按观测到的吞吐量用爬山法调整：增加并发后吞吐量下降就反向调整，
+    避免机械硬盘和网络存储上同时读写多个大文件导致来回寻道；小文件不受限制
+    """
+    
+    METHODS = ('copy_file_range', 'sendfile', 'userspace')
+    
+    def __init__(self, max_workers=8, large_file_size=64 * 1024 * 1024, verify=False, window=2.0):
+        self.max_workers = max_workers
+        self.large_file_size = large_file_size
+        self.verify = verify
+        self.window = window
+        self.methods = [method for method in self.METHODS if method == 'userspace' or hasattr(os, method)]
         
-        self.input_dir = Path(self.config['input'])
-        self.output_dir = Path(self.config['output'])
-        self.title = self.config.get('title', 'Image Gallery')
-        self.footer = self.config.get('footer', 'Gallery')
-        self.footer_link = self.config.get('footer-link', '#')
+        self.condition = threading.Condition()
+        self.limit = min(2, max_workers)
+        self.active = 0
+        self.direction = 1
+        # 统计窗口只在有大文件正在复制时计时，空闲期间为 None
+        self.window_start = None
+        self.window_bytes = 0
+        self.last_throughput = None
+        self.stats = {'files': 0, 'bytes': 0}
+    
+    def record_progress(self, count):
+        """累计大文件复制的字节数，每个统计窗口结束时按吞吐量变化调整大文件并发数"""
+        with self.condition:
+            if self.window_start is None:
+                self.window_start = time.perf_counter()
+            self.window_bytes += count
+            elapsed = time.perf_counter() - self.window_start
+            if elapsed < self.window:
+                return
+            throughput = self.window_bytes / elapsed
+            if self.last_throughput is not None and throughput < self.last_throughput * 0.95:
+                self.direction = -self.direction
+            self.limit = min(self.max_workers, max(1, self.limit + self.direction))
+            self.last_throughput = throughput
+            self.window_start = time.perf_counter()
+            self.window_bytes = 0
+            self.condition.notify_all()
+    
+    @contextmanager
+    def slot(self, size):
+        """大文件需要等待空闲的并发名额"""
+        if size < self.large_file_size:
+            yield
+            return
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+            if self.window_start is None:
+                self.window_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                if self.active == 0:
+                    # 没有大文件在复制时结束统计窗口，空闲时间不计入下一次的吞吐量
+                    self.window_start = None
+                    self.window_bytes = 0
+                self.condition.notify_all()
+    
+    def copy(self, src_path, dest_path, known_hash=None):
+        """复制单个文件并保留修改时间，启用校验时比较源文件和目标文件的哈希；返回 (字节数, 耗时, 复制方式)"""
+        start_time = time.perf_counter()
+        size = os.path.getsize(src_path)
+        # 只有受并发限制的大文件的进度用于调整并发数
+        progress = self.record_progress if size >= self.large_file_size else None
+        with self.slot(size):
+            while True:
+                method = self.methods[0]
+                try:
+                    copied = copy_file_contents(method, src_path, dest_path, progress)
+                    break
+                except OSError as e:
+                    # 文件系统或内核不支持时改用下一种方式，之后的文件不再尝试
+                    if method == 'userspace' or e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                                                                 errno.EOPNOTSUPP, errno.ENOTSUP):
+                        raise
+                    with self.condition:
+                        if method in self.methods:
+                            self.methods.remove(method)
         
-        # 字体配置
-        self.title_font = self.config.get('title-font', '')
-        self.footer_font = self.config.get('footer-font', '')
-        self.global_font = self.config.get('global-font', '')
+        if self.verify and hash_file(dest_path) != (known_hash or hash_file(src_path)):
+            os.unlink(dest_path)
+            raise OSError(errno.EIO, f"复制后校验失败: {src_path}")
         
-        # 版权年份配置
-        self.start_year = self.config.get('start-year', None)
-        self.start_date = self.config.get('start-date', None)
+        with self.condition:
+            self.stats['files'] += 1
+            self.stats['bytes'] += copied
+        return copied, time.perf_counter() - start_time, method
+
+
+class FFmpegPosterExtractor:
+    """使用 ffprobe 读取视频时长，ffmpeg 截取一帧作为封面"""
     
-    def get_copyright_year(self):
-        """生成版权年份字符串"""
-        current_year = datetime.now().year
-        
-        # 优先使用start-date，如果没有则使用start-year
-        start_year = None
+    name = 'ffmpeg'
+    
+    @staticmethod
+    def available():
+        return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+    
+    def probe_duration(self, src_path):
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
+             str(src_path)],
+            capture_output=True, text=True, timeout=60,
+        )
+        try:
+            return round(float(result.stdout.strip()), 2)
+        except ValueError:
+            return None
+    
+    def extract(self, src_path, poster_path, width):
+        """
+        读取时长并把一帧缩放到不超过 width 的 JPEG 写入 poster_path，返回 (时长秒数, 是否生成封面)
+        封面按内容哈希命名，文件已存在时（相同内容的视频）只读取时长
+        """
+        duration = self.probe_duration(src_path)
+        if not os.path.exists(poster_path):
+            # 跳过开头可能出现的黑场
+            offset = min(1.0, duration / 10) if duration else 0
+            tmp_path = f"{poster_path}.tmp.jpg"
+            subprocess.run(
+                ['ffmpeg', '-v', 'error', '-y', '-ss', f'{offset:.2f}', '-i', str(src_path), '-frames:v', '1',
+                 '-vf', f"scale='min({width},iw)':-2", '-q:v', '4', tmp_path],
+                check=True, capture_output=True, timeout=120,
+            )
+            os.replace(tmp_path, poster_path)
+        return duration, True
+
+
+class PlaceholderPosterExtractor:
+    """不提取封面，视频卡片使用主题中的占位图"""
+    
+    name = 'placeholder'
+    
+    @staticmethod
+    def available():
+        return True
+    
+    def extract(self, src_path, poster_path, width):
+        return None, False
+
+
+# 视频封面提取器，按 video-posters 配置选择；auto 时依次尝试，使用第一个可用的
+VIDEO_POSTER_EXTRACTORS = {
+    'ffmpeg': FFmpegPosterExtractor,
+    'placeholder': PlaceholderPosterExtractor,
+}
+
+
+def format_duration(seconds):
+    """把秒数格式化为 m:ss 或 h:mm:ss"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class BuildCache:
+    """
+    持久化构建清单（输出目录下的 .gallery-cache.json）
+    记录每个源文件的大小、修改时间（可选内容哈希）以及由它生成的输出文件，
+    使每次构建只重写发生变化的媒体、缩略图和页面，并清理孤立的输出文件
+    """
+    
+    VERSION = 1
+    FILENAME = '.gallery-cache.json'
+    
+    # 随源文件一起缓存的媒体字段，源文件未变化时直接恢复
+    MEDIA_FIELDS = ('hash', 'phash', 'location', 'meta', 'thumbnails', 'transcoded', 'placeholder', 'video')
+    
+    def __init__(self, output_dir, use_hash=False, filename=FILENAME):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / filename
+        self.use_hash = use_hash
+        self.loaded = False
+        self.previous = {'signature': None, 'sources': {}, 'albums': {}}
         
-        if self.start_date:
+        if self.path.exists():
             try:
-                # 解析日期字符串，支持多种格式
-                if isinstance(self.start_date, str):
-                    # 尝试解析 YYYY-MM-DD 格式
-                    if '-' in self.start_date:
-                        parsed_date = datetime.strptime(self.start_date, '%Y-%m-%d')
-                        start_year = parsed_date.year
-                    # 尝试解析 YYYY/MM/DD 格式
-                    elif '/' in self.start_date:
-                        parsed_date = datetime.strptime(self.start_date, '%Y/%m/%d')
-                        start_year = parsed_date.year
-                    # 尝试解析 YYYY.MM.DD 格式
-                    elif '.' in self.start_date:
-                        parsed_date = datetime.strptime(self.start_date, '%Y.%m.%d')
-                        start_year = parsed_date.year
-                    else:
-                        # 如果只是年份字符串
-                        start_year = int(self.start_date)
-                else:
-                    start_year = int(self.start_date)
-            except (ValueError, TypeError):
-                print(f"⚠️  警告: 无法解析start-date '{self.start_date}'，将忽略此配置")
-                start_year = None
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.VERSION:
+                    self.previous = data
+                    self.loaded = True
+            except (OSError, ValueError) as e:
+                print(f"⚠️  警告: 无法读取构建缓存 {self.path}，将完整重新构建: {e}")
         
-        # 如果没有start_date，使用start_year
-        if start_year is None and self.start_year is not None:
-            start_year = self.start_year
+        self.signature = None
+        self.settings = {}
+        self.snapshot = {}
+        self.sources = {}
+        self.albums = {}
+        self.assets = []
+        self.fonts = {}
+        self.search = {}
+        self.compressed = {}
+    
+    def lookup(self, key, media, verify_outputs=True):
+        """返回未变化源文件的上次构建记录；文件已变化或输出缺失时返回 None"""
+        entry = self.previous['sources'].get(key)
+        if not entry or entry['size'] != media['size']:
+            return None
         
-        # 生成版权年份字符串
-        if start_year is None:
-            # 如果没有设置开始年份，只显示当前年份
-            return str(current_year)
+        if entry['mtime'] != media['mtime']:
+            # 修改时间变化但内容可能没变（如 git checkout），启用哈希时按内容判断
+            if not self.use_hash or not entry.get('hash'):
+                return None
+            media['hash'] = hash_file(media['path'])
+            if media['hash'] != entry['hash']:
+                return None
         
-        # 验证年份范围的合理性
-        if start_year > current_year:
-            print(f"⚠️  警告: 开始年份 {start_year} 大于当前年份 {current_year}，将使用当前年份")
-            return str(current_year)
+        if verify_outputs and not all((self.output_dir / output).exists() for output in entry['outputs']):
+            return None
+        return entry
+    
+    def record_media(self, key, media):
+        """记录源文件及其派生输出"""
+        entry = {
+            'size': media['size'],
+            'mtime': media['mtime'],
+            'outputs': sorted(set(media.get('outputs', []))),
+        }
+        for field in self.MEDIA_FIELDS:
+            if media.get(field) is not None:
+                entry[field] = media[field]
+        self.sources[key] = entry
+    
+    def album_unchanged(self, name, digest, verify_outputs=True):
+        """判断相册页面能否沿用上次构建结果"""
+        entry = self.previous['albums'].get(name)
+        if entry is None or self.previous['signature'] != self.signature or entry['digest'] != digest:
+            return False
+        return not verify_outputs or all((self.output_dir / page).exists() for page in entry['pages'])
+    
+    def record_album(self, name, digest, pages):
+        self.albums[name] = {'digest': digest, 'pages': sorted(pages)}
+    
+    def remove_orphans(self):
+        """删除上次构建生成、本次不再需要的输出文件，返回删除数量"""
+        current = set()
+        for entry in self.sources.values():
+            current.update(entry['outputs'])
+        for entry in self.albums.values():
+            current.update(entry['pages'])
+        current.update(self.assets)
         
-        # 如果设置了开始年份
-        if start_year == current_year:
-            # 如果开始年份等于当前年份，只显示当前年份
-            return str(current_year)
-        else:
-            # 否则显示年份范围
-            return f"{start_year}-{current_year}"
+        previous = set(self.previous.get('assets', []))
+        for entry in self.previous['sources'].values():
+            previous.update(entry['outputs'])
+        for entry in self.previous['albums'].values():
+            previous.update(entry['pages'])
         
-    def get_media_type(self, file_path):
-        """判断媒体类型"""
-        ext = file_path.suffix.lower()
-        video_extensions = {'.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.mkv', '.m4v'}
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
+        removed = 0
+        parents = set()
+        for output in previous - current:
+            path = self.output_dir / output
+            if path.is_file() or path.is_symlink():
+                path.unlink()
+                removed += 1
+                parents.add(path.parent)
+            # 同时删除预压缩副本
+            for suffix in PRECOMPRESS_SUFFIXES:
+                sidecar = path.with_name(path.name + suffix)
+                if sidecar.exists():
+                    sidecar.unlink()
         
-        if ext in video_extensions:
-            return 'video'
-        elif ext in image_extensions:
-            return 'image'
-        return 'unknown'
+        # 清理变空的目录
+        for parent in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+            while parent != self.output_dir and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        return removed
+    
+    def save(self):
+        """原子写入构建清单"""
+        data = {
+            'version': self.VERSION,
+            'signature': self.signature,
+            'settings': self.settings,
+            'snapshot': self.snapshot,
+            'sources': self.sources,
+            'albums': self.albums,
+            'assets': self.assets,
+            'fonts': self.fonts,
+            'search': self.search,
+            'compressed': self.compressed,
+        }
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def call_with_cpu_time(func, *args, **kwargs):
+    """执行 func 并返回 (结果, 当前线程消耗的CPU时间)，用于统计线程池和进程池中任务的CPU时间"""
+    cpu_before = time.thread_time()
+    result = func(*args, **kwargs)
+    return result, time.thread_time() - cpu_before
+
+
+class ProfiledExecutor:
+    """
+    包装线程池或进程池：在 BuildProfiler.stage() 中提交的任务，其在工作线程或子进程中消耗的CPU时间
+    计入提交时所在的步骤；不在任何步骤中提交的任务直接交给原来的线程池
+    """
     
+    def __init__(self, profiler, executor):
+        self.profiler = profiler
+        self.executor = executor
+        self.field = 'child_cpu_seconds' if isinstance(executor, ProcessPoolExecutor) else 'cpu_seconds'
     
-    def parse_album_name(self, folder_name):
-        """
-        解析相册文件夹名称，提取序号和显示名称
-        支持格式：
-        - "01-相册名" -> (1, "相册名", "01-相册名")
-        - "001_相册名" -> (1, "相册名", "001_相册名")
-        - "相册名" -> (None, "相册名", "相册名")
-        """
-        # 尝试匹配开头的序号模式：数字 + 分隔符（-、_、空格、.）
-        match = re.match(r'^(\d+)[-_\.\s]+(.+)$', folder_name)
-        
-        if match:
-            order = int(match.group(1))
-            display_name = match.group(2)
-            return (order, display_name, folder_name)
-        else:
-            # 没有序号，使用原名称
-            return (None, folder_name, folder_name)
+    def __enter__(self):
+        return self
     
-    def scan_gallery(self):
-        """扫描画廊目录，获取所有相册和媒体文件"""
-        albums = []
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+        return False
+    
+    def shutdown(self, *args, **kwargs):
+        self.executor.shutdown(*args, **kwargs)
+    
+    def submit(self, func, *args, **kwargs):
+        stage = getattr(self.profiler.local, 'stage', None)
+        if stage is None:
+            return self.executor.submit(func, *args, **kwargs)
         
-        # 获取封面配置
-        galleries_config = self.config.get('galleries', {})
+        future = Future()
         
-        for item in self.input_dir.iterdir():
-            if item.is_dir():
-                # 解析文件夹名称，提取序号和显示名称
-                order, display_name, folder_name = self.parse_album_name(item.name)
-                
-                album = {
-                    'name': item.name,  # 原始文件夹名（用于文件路径）
-                    'display_name': display_name,  # 显示名称（隐藏序号）
-                    'order': order,  # 排序序号
-                    'path': item,
-                    'media': [],
-                    'thumbnail': None,
-                    'cover': None,
-                    'count': 0
-                }
-                
-                # 检查是否有配置的封面
-                album_config = galleries_config.get(item.name, {})
-                cover_path = album_config.get('cover', '')
-                
-                if cover_path:
-                    # 处理封面路径
-                    if cover_path.startswith('http'):
-                        # 完整URL
-                        album['cover'] = cover_path
-                    elif cover_path.startswith('/'):
-                        # 相对路径，去掉开头的斜杠
-                        album['cover'] = cover_path[1:]
-                    else:
-                        # 相对路径
-                        album['cover'] = cover_path
-                
-                # 扫描相册内的媒体文件
-                media_files = list(item.iterdir())
-                media_files.sort(key=lambda x: x.name)  # 按文件名排序确保顺序一致
-                for media_file in media_files:
-                    if media_file.is_file():
-                        media_type = self.get_media_type(media_file)
-                        if media_type in ['image', 'video']:
-                            media_info = {
-                                'name': media_file.name,
-                                'path': media_file,
-                                'type': media_type,
-                                'size': media_file.stat().st_size,
-                                'modified': datetime.fromtimestamp(media_file.stat().st_mtime)
-                            }
-                            
-                            album['media'].append(media_info)
-                            
-                            # 设置相册缩略图（第一个文件）
-                            if not album['thumbnail']:
-                                album['thumbnail'] = media_info
-                
-                album['count'] = len(album['media'])
-                if album['count'] > 0:
-                    albums.append(album)
+        def done(inner):
+            try:
+                result, cpu_seconds = inner.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            self.profiler.add_stage(stage, **{self.field: cpu_seconds})
+            future.set_result(result)
         
-        # 排序：有序号的按序号排序，没有序号的按名称排序，有序号的排在前面
-        albums.sort(key=lambda x: (x['order'] is None, x['order'] if x['order'] is not None else 0, x['display_name']))
-        return albums
+        self.executor.submit(call_with_cpu_time, func, *args, **kwargs).add_done_callback(done)
+        return future
+
+
+class BuildProfiler:
+    """
+    构建性能记录器
+    按阶段记录墙钟时间、CPU时间（含子进程）、读写字节数和处理的文件数，并记录每个相册的耗时；
+    流水线中各相册的扫描、复制、缩略图等步骤相互重叠，按步骤累计耗时、CPU时间和文件数；
+    未启用时 phase() 和 stage() 只是空的上下文管理器，不产生额外开销
+    """
     
-    def copy_media_files(self, albums):
-        """并行复制媒体文件到输出目录"""
-        def copy_single_media(media_info):
-            album_name, media = media_info
-            album_dir = self.output_dir / album_name
-            album_dir.mkdir(parents=True, exist_ok=True)
-            
-            dest_path = album_dir / media['name']
-            
-            # 检查文件是否需要复制（避免重复复制）
-            if dest_path.exists() and dest_path.stat().st_size == media['size']:
-                # 文件已存在且大小相同，跳过复制
-                # URL编码文件名以处理特殊字符（如#）
-                encoded_name = urllib.parse.quote(media['name'], safe='')
-                media['url'] = f'{album_name}/{encoded_name}'
-                return f"跳过: {media['name']}"
-            
-            # 复制文件
-            shutil.copy2(media['path'], dest_path)
-            # URL编码文件名以处理特殊字符（如#）
-            encoded_name = urllib.parse.quote(media['name'], safe='')
-            media['url'] = f'{album_name}/{encoded_name}'
-            return f"复制: {media['name']}"
-        
-        # 准备所有复制任务
-        copy_tasks = []
-        for album in albums:
-            for media in album['media']:
-                copy_tasks.append((album['name'], media))
-        
-        # 并行执行复制任务
-        print(f"📋 开始并行复制 {len(copy_tasks)} 个媒体文件...")
-        start_time = time.time()
+    STAGE_FIELDS = ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'files')
+    
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = []
+        self.albums = {}
+        self.stages = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+    
+    @staticmethod
+    def read_io_counters():
+        """读取本进程的累计读写字节数，Linux 使用 /proc/self/io，其他平台使用块读写次数估算"""
+        try:
+            with open('/proc/self/io', 'r') as f:
+                fields = dict(line.split(': ') for line in f.read().splitlines())
+            return int(fields['rchar']), int(fields['wchar'])
+        except (OSError, KeyError, ValueError):
+            pass
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_inblock * 512, usage.ru_oublock * 512
+        return 0, 0
+    
+    @contextmanager
+    def phase(self, name):
+        """记录一个构建阶段；阶段内可以设置 record['files'] 为处理的文件数"""
+        record = {'name': name, 'files': 0}
+        if not self.enabled:
+            yield record
+            return
         
-        with ThreadPoolExecutor(max_workers=min(8, len(copy_tasks))) as executor:
-            futures = [executor.submit(copy_single_media, task) for task in copy_tasks]
-            
-            completed = 0
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    completed += 1
-                    if completed % 10 == 0 or completed == len(copy_tasks):
-                        print(f"   进度: {completed}/{len(copy_tasks)}")
-                except Exception as e:
-                    print(f"   错误: {e}")
+        times_before = os.times()
+        read_before, written_before = self.read_io_counters()
+        wall_before = time.perf_counter()
+        try:
+            yield record
+        finally:
+            times_after = os.times()
+            read_after, written_after = self.read_io_counters()
+            record.update({
+                'wall_seconds': round(time.perf_counter() - wall_before, 4),
+                'cpu_seconds': round((times_after.user - times_before.user) + (times_after.system - times_before.system), 4),
+                # 进程池中的子进程在阶段结束前已被回收，其CPU时间计入 children
+                'child_cpu_seconds': round(
+                    (times_after.children_user - times_before.children_user)
+                    + (times_after.children_system - times_before.children_system), 4),
+                'bytes_read': read_after - read_before,
+                'bytes_written': written_after - written_before,
+            })
+            self.phases.append(record)
+    
+    @contextmanager
+    def stage(self, name):
+        """
+        记录流水线步骤的一次执行（可在线程中调用），可以设置 record['files'] 为处理的文件数；
+        执行期间提交到 wrap_executor() 包装的线程池或进程池的任务，其CPU时间也计入该步骤
+        """
+        record = {'files': 0}
+        if not self.enabled:
+            yield record
+            return
         
-        elapsed = time.time() - start_time
-        print(f"✅ 媒体文件复制完成，耗时: {elapsed:.2f}秒")
+        previous = getattr(self.local, 'stage', None)
+        self.local.stage = name
+        wall_before = time.perf_counter()
+        cpu_before = time.thread_time()
+        try:
+            yield record
+        finally:
+            self.local.stage = previous
+            self.add_stage(name, wall_seconds=time.perf_counter() - wall_before,
+                           cpu_seconds=time.thread_time() - cpu_before, files=record['files'])
     
-    def generate_index_html(self, albums):
-        """生成首页HTML"""
-        html = f"""<!DOCTYPE html>
+    def add_stage(self, name, **values):
+        """累加步骤的耗时、CPU时间或文件数（可在线程中调用）"""
+        with self.lock:
+            totals = self.stages.setdefault(name, dict.fromkeys(self.STAGE_FIELDS, 0))
+            for field, value in values.items():
+                totals[field] += value
+    
+    def pop_stages(self):
+        """取出累计的步骤记录，墙钟时间为各相册该步骤耗时之和"""
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        return [
+            {'name': name, **{field: round(value, 4) for field, value in totals.items()}}
+            for name, totals in stages.items()
+        ]
+    
+    def wrap_executor(self, executor):
+        """启用时包装线程池或进程池，统计各步骤提交的任务的CPU时间"""
+        return ProfiledExecutor(self, executor) if self.enabled else executor
+    
+    def record_album(self, name, phase, seconds, files):
+        """记录单个相册在某阶段的耗时（可在线程中调用）"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.albums.setdefault(name, {})[phase] = {'seconds': round(seconds, 4), 'files': files}
+    
+    def report(self):
+        return {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'argv': sys.argv,
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'totals': self.totals,
+            'phases': self.phases,
+            'albums': self.albums,
+        }
+    
+    def print_summary(self):
+        print("📈 各阶段耗时:")
+        for record in self.phases:
+            print(f"   {record['name']:<12} {record['wall_seconds']:>8.2f}秒  CPU {record['cpu_seconds'] + record['child_cpu_seconds']:>8.2f}秒  "
+                  f"文件 {record['files']:>7}  读 {record['bytes_read'] / 1048576:>9.1f}MB  写 {record['bytes_written'] / 1048576:>9.1f}MB")
+            # 流水线各步骤并行执行，耗时为各相册累计值，总和可能超过阶段的墙钟时间
+            for stage in record.get('stages', []):
+                print(f"     · {stage['name']:<12} {stage['wall_seconds']:>8.2f}秒  "
+                      f"CPU {stage['cpu_seconds'] + stage['child_cpu_seconds']:>8.2f}秒  文件 {stage['files']:>7}  （累计）")
+    
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+# 视频缩略图占位符（主题中的静态文件，所有页面共用一份）
+VIDEO_PLACEHOLDER_URL = 'video-placeholder.svg'
+SEARCH_INDEX_URL = 'search/index.json'
+
+# 旧版本的媒体页面地址：media_<相册>_<序号>_<文件名哈希>.html（序号和哈希的格式固定，相册部分可以唯一确定）
+LEGACY_MEDIA_PAGE_PATTERN = re.compile(r'media_(.+)_(\d+)_([0-9a-f]{8})\.html')
+
+# 搜索分词：中日韩文字逐字索引，其他文字按连续的字母数字索引（与 enhancements.js 中的分词规则一致）
+SEARCH_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+SEARCH_TOKEN_PATTERN = re.compile(f"[{SEARCH_CJK_CHARS}]|(?:(?![{SEARCH_CJK_CHARS}])[^\\W_])+")
+
+
+class PageTemplate:
+    """
+    预编译的页面模板
+    模板文本中的 {{name}} 占位符在编译时拆分为静态片段和变量名，构建期间固定的值（标题、页脚、
+    版权年份等）在编译时直接合并进静态片段；渲染时按顺序产出字符串片段，可直接交给 writelines
+    """
+    
+    PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
+    
+    def __init__(self, text, **static_values):
+        self.parts = []  # [(是否为变量, 静态文本或变量名), ...]
+        literal = []
+        position = 0
+        for match in self.PLACEHOLDER.finditer(text):
+            literal.append(text[position:match.start()])
+            name = match.group(1)
+            if name in static_values:
+                literal.append(static_values[name])
+            else:
+                self.parts.append((False, ''.join(literal)))
+                self.parts.append((True, name))
+                literal = []
+            position = match.end()
+        literal.append(text[position:])
+        self.parts.append((False, ''.join(literal)))
+    
+    def render(self, **values):
+        """按顺序产出片段；变量值可以是字符串，也可以是产出字符串片段的可迭代对象"""
+        for is_variable, value in self.parts:
+            if not is_variable:
+                yield value
+                continue
+            value = values[value]
+            if isinstance(value, str):
+                yield value
+            else:
+                yield from value
+
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{self.title}</title>
-    <link rel="stylesheet" href="style.css">
+    <title>{{page_title}}</title>
+    {{stylesheet}}
     <link rel="icon" type="image/x-icon" href="favicon.ico">
-    <meta name="description" content="图片画廊 - {self.title}">
+    <meta name="description" content="{{description}}">
     <meta name="robots" content="index, follow">
-    <link rel="preload" href="style.css" as="style">
-    <link rel="preload" href="enhancements.js" as="script">
+    <link rel="preload" href="{{script}}" as="script">{{head}}
 </head>
 <body>
     <div class="header">
-        <h1>{self.title}</h1>
+        <h1>{{title}}</h1>
     </div>
 
     <div class="main">
         <div class="breadcrumb">
-            <a href="index.html">首页</a> / <span>所有相册</span>
+            {{breadcrumb}}
         </div>
+{{main}}
+    </div>
 
-        <div class="albums" id="albums-container">
-"""
-        
-        for album in albums:
-            # 确定缩略图URL
-            thumbnail_url = None
-            
-            # 优先使用配置的封面
-            if album.get('cover'):
-                thumbnail_url = album['cover']
-            elif album['thumbnail']:
-                # 如果相册的第一个文件是视频，使用SVG占位符
-                if album['thumbnail']['type'] == 'video':
-                    svg_content = '''<svg width="400" height="300" viewBox="0 0 400 300" fill="none" xmlns="http://www.w3.org/2000/svg">
-<rect width="400" height="300" fill="#f0f0f0"/>
-<circle cx="200" cy="150" r="30" fill="#333"/>
-<path d="M185 135L215 150L185 165V135Z" fill="white"/>
-<text x="200" y="200" text-anchor="middle" fill="#666" font-family="Arial" font-size="16">视频文件</text>
-</svg>'''
-                    svg_base64 = base64.b64encode(svg_content.encode('utf-8')).decode('utf-8')
-                    thumbnail_url = f'data:image/svg+xml;base64,{svg_base64}'
-                else:
-                    thumbnail_url = album['thumbnail']['url']
-            
-            # 确定媒体类型显示
-            media_types = set(media['type'] for media in album['media'])
-            if 'video' in media_types and 'image' in media_types:
-                type_text = f"{album['count']} 个文件"
-            elif 'video' in media_types:
-                type_text = f"{album['count']} 个视频"
-            else:
-                type_text = f"{album['count']} 张图片"
-            
-            # 生成安全的相册页面链接（用下划线替换空格）
-            safe_album_name = album['name'].replace(' ', '_')
-            
-            html += f"""
-            <div class="album" data-page="1">
-                <a href="album_{safe_album_name}.html">
-                    <div class="album-thumbnail">
-"""
-            
-            if thumbnail_url:
-                html += f'                        <img src="{thumbnail_url}" alt="{album["display_name"]}" loading="lazy" decoding="async">'
-            else:
-                html += '                        <div class="no-thumbnail">无预览图</div>'
-            
-            html += f"""
-                    </div>
-                    <div class="album-info">
-                        <h3 class="album-title">{album['display_name']}</h3>
-                        <p class="album-count">{type_text}</p>
-                    </div>
-                </a>
-            </div>
-"""
-        
-        html += """
+    <div class="footer">
+        <p>© {{copyright_year}} <a href="{{footer_link}}" target="_blank">{{footer}}</a> • Powered by <a href="https://gw124.com/" target="_blank">Wen</a></p>
+    </div>
+{{scripts}}
+    <script src="{{script}}" data-config="{{config}}"{{search}}></script>
+</body>
+</html>'''
+
+GRID_TEMPLATE = '''
+        {{header}}<div class="albums" id="{{container_id}}">
+{{cards}}
         </div>
-        
+        {{pagination}}'''
+
+# 客户端分页控件，由 enhancements.js 按每页9项切换显示
+CLIENT_PAGINATION_HTML = '''
         <!-- 分页控件 -->
         <div class="pagination-container">
             <div class="pagination-info">
@@ -346,433 +968,2665 @@ class GalleryBuilder:
                     </svg>
                 </button>
             </div>
-        </div>
-    </div>
-
-    <div class="footer">
-        <p>© {self.get_copyright_year()} <a href="{self.footer_link}" target="_blank">{self.footer}</a> • Powered by <a href="https://gw124.com/" target="_blank">Wen</a></p>
-    </div>
-
-    <script src="enhancements.js"></script>
-</body>
-</html>"""
-        
-        return html
-    
-    def generate_album_html(self, album):
-        """生成相册页面HTML"""
-        html = f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{album['display_name']} - {self.title}</title>
-    <link rel="stylesheet" href="style.css">
-    <link rel="icon" type="image/x-icon" href="favicon.ico">
-    <meta name="description" content="相册 - {album['display_name']}">
-    <meta name="robots" content="index, follow">
-    <link rel="preload" href="style.css" as="style">
-    <link rel="preload" href="enhancements.js" as="script">
-</head>
-<body>
-    <div class="header">
-        <h1>{self.title}</h1>
-    </div>
-
-    <div class="main">
-        <div class="breadcrumb">
-            <a href="index.html">首页</a> / <span>{album['display_name']}</span>
-        </div>
+        </div>'''
 
-        <div class="album-header">
-            <h2>{album['display_name']}</h2>
-        </div>
+# 服务端分页控件，每一页都是独立的静态页面
+SERVER_PAGINATION_TEMPLATE = '''
+        <!-- 分页控件 -->
+        <nav class="pagination-container" data-server-pagination="true" data-current-page="{{page}}" data-total-pages="{{total_pages}}">
+            <div class="pagination-info">
+                <span>显示 {{first_item}}-{{last_item}} 项，共 {{total_items}} 项</span>
+            </div>
+            <div class="pagination">
+                {{prev}}
+                <div class="pagination-numbers">
+                    {{numbers}}
+                </div>
+                {{next}}
+            </div>
+        </nav>'''
 
-        <div class="albums" id="media-container">
-"""
-        
-        for i, media in enumerate(album['media']):
-            # 确定缩略图URL
-            if media['type'] == 'video':
-                # 视频文件使用占位符，不显示实际视频
-                svg_content = '''<svg width="400" height="300" viewBox="0 0 400 300" fill="none" xmlns="http://www.w3.org/2000/svg">
-<rect width="400" height="300" fill="#f0f0f0"/>
-<circle cx="200" cy="150" r="30" fill="#333"/>
-<path d="M185 135L215 150L185 165V135Z" fill="white"/>
-<text x="200" y="200" text-anchor="middle" fill="#666" font-family="Arial" font-size="16">视频文件</text>
-</svg>'''
-                svg_base64 = base64.b64encode(svg_content.encode('utf-8')).decode('utf-8')
-                thumbnail_url = f'data:image/svg+xml;base64,{svg_base64}'
-            else:
-                thumbnail_url = media['url']
-            
-            # 生成安全的媒体页面链接（使用索引和哈希）
-            media_hash = hashlib.md5(media['name'].encode('utf-8')).hexdigest()[:8]
-            media_link = f"media_{album['name']}_{i}_{media_hash}.html"
-            
-            html += f"""
+CARD_TEMPLATE = '''
             <div class="album" data-page="1">
-                <a href="{media_link}">
-                    <div class="album-thumbnail">
-                        <img src="{thumbnail_url}" alt="{media['name']}" loading="lazy" decoding="async">
+                <a href="{{link}}">
+                    <div class="album-thumbnail"{{placeholder}}>
+                        {{thumbnail}}
                     </div>
                     <div class="album-info">
-                        <h3 class="album-title">{media['name']}</h3>
-                        <p class="album-count">{media['modified'].strftime('%Y-%m-%d')}</p>
+                        <h3 class="album-title">{{title}}</h3>
+                        <p class="album-count">{{subtitle}}</p>
                     </div>
                 </a>
             </div>
-"""
-        
-        html += """
-        </div>
-        
-        <!-- 分页控件 -->
-        <div class="pagination-container">
-            <div class="pagination-info">
-                <span id="pagination-info">显示 1-9 项，共 10 项</span>
+'''
+
+VIDEO_TEMPLATE = '''
+                <video controls preload="metadata"{{poster}} style="width: 100%; max-width: 800px; height: auto;" onerror="console.error('视频加载失败:', this.error); this.style.display='none'; this.nextElementSibling.style.display='block';">
+                    <source src="{{url}}" type="{{mime_type}}">
+                    您的浏览器不支持视频播放。
+                </video>
+                <div style="display: none; padding: 20px; text-align: center; background: #f5f5f5; border-radius: 8px;">
+                    <p>视频加载失败</p>
+                    <p>文件路径: {{url}}</p>
+                    <p>编码路径: {{url}}</p>
+                    <p>MIME类型: {{mime_type}}</p>
+                    <a href="{{url}}" download>点击下载视频文件</a>
+                </div>
+'''
+
+MEDIA_TEMPLATE = '''
+        <div class="media-viewer">
+            <div class="media-content">
+{{content}}
             </div>
-            <div class="pagination">
-                <button class="pagination-btn prev-btn" id="prev-btn" disabled>
-                    <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                        <polyline points="15,18 9,12 15,6"></polyline>
-                    </svg>
-                    上一页
-                </button>
-                <div class="pagination-numbers" id="pagination-numbers">
+            
+            <div class="media-details">
+                <h2>{{name}}</h2>
+                <p class="media-date">{{date}}</p>
+                <p class="media-size">文件大小: {{size}} KB</p>
+                
+                <div class="media-actions">
+                    <button id="copy-url-btn" class="copy-btn" onclick="copyMediaUrl()">
+                        <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                            <rect x="9" y="9" width="13" height="13" rx="2" ry="2"></rect>
+                            <path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"></path>
+                        </svg>
+                        复制链接
+                    </button>
+                    <span id="copy-status" class="copy-status"></span>
                 </div>
-                <button class="pagination-btn next-btn" id="next-btn">
-                    下一页
-                    <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                        <polyline points="9,18 15,12 9,6"></polyline>
-                    </svg>
-                </button>
             </div>
-        </div>
-    </div>
+        </div>'''
 
-    <div class="footer">
-        <p>© {self.get_copyright_year()} <a href="{self.footer_link}" target="_blank">{self.footer}</a> • Powered by <a href="https://gw124.com/" target="_blank">Wen</a></p>
-    </div>
+MEDIA_SCRIPT_TEMPLATE = '''
+    <script>
+        // 媒体URL数据
+        const mediaUrl = "{{url}}";
+        const mediaType = "{{type}}";
+        
+        // 复制媒体URL函数
+        function copyMediaUrl() {
+            const fullUrl = window.location.origin + '/' + mediaUrl;
+            
+            if (navigator.clipboard && window.isSecureContext) {
+                // 使用现代 Clipboard API
+                navigator.clipboard.writeText(fullUrl).then(function() {
+                    showCopyStatus('✅ 链接已复制到剪贴板！', 'success');
+                }).catch(function(err) {
+                    console.error('复制失败:', err);
+                    fallbackCopy(fullUrl);
+                });
+            } else {
+                // 回退方案
+                fallbackCopy(fullUrl);
+            }
+        }
+        
+        // 回退复制方案
+        function fallbackCopy(text) {
+            const textArea = document.createElement('textarea');
+            textArea.value = text;
+            textArea.style.position = 'fixed';
+            textArea.style.left = '-999999px';
+            textArea.style.top = '-999999px';
+            document.body.appendChild(textArea);
+            textArea.focus();
+            textArea.select();
+            
+            try {
+                const successful = document.execCommand('copy');
+                if (successful) {
+                    showCopyStatus('✅ 链接已复制到剪贴板！', 'success');
+                } else {
+                    showCopyStatus('❌ 复制失败，请手动复制', 'error');
+                }
+            } catch (err) {
+                console.error('复制失败:', err);
+                showCopyStatus('❌ 复制失败，请手动复制', 'error');
+            }
+            
+            document.body.removeChild(textArea);
+        }
+        
+        // 显示复制状态
+        function showCopyStatus(message, type) {
+            const statusElement = document.getElementById('copy-status');
+            statusElement.textContent = message;
+            statusElement.className = `copy-status ${type}`;
+            
+            // 3秒后清除状态
+            setTimeout(() => {
+                statusElement.textContent = '';
+                statusElement.className = 'copy-status';
+            }, 3000);
+        }
+    </script>
+    '''
 
-    <script src="enhancements.js"></script>
-</body>
-</html>"""
+# 虚拟滚动网格：卡片由 enhancements.js 根据 JSON 清单按需渲染
+VIRTUAL_GRID_TEMPLATE = '''
+        {{header}}<div class="virtual-grid" id="media-container" data-manifest="{{manifest}}" data-count="{{count}}"></div>
+        <noscript>
+            <p class="virtual-grid-noscript">请启用 JavaScript 以浏览相册内容。</p>
+        </noscript>'''
+
+# 首屏渲染需要的样式规则（按选择器开头匹配），启用 inline-config 时内联到页面中
+CRITICAL_CSS_SELECTORS = (
+    ':root', '*', 'body', '.header', '.main', '.breadcrumb', '.albums', '.album', '.album-thumbnail',
+    '.album-info', '.album-title', '.album-count', '.album-header', '.media-viewer', '.media-content',
+)
+
+# 字体扩展名对应的 preload type
+FONT_MIME_TYPES = {'.ttf': 'font/ttf', '.otf': 'font/otf', '.woff': 'font/woff', '.woff2': 'font/woff2'}
+
+DEFAULT_FONT_STACK = '-apple-system, BlinkMacSystemFont, sans-serif'
+
+
+def extract_critical_css(css, selectors=CRITICAL_CSS_SELECTORS):
+    """
+    从样式表中提取首屏需要的规则：保留以 selectors 中某一项开头、且不含 :hover 的选择器，
+    @media 块内的规则同样筛选，@font-face 全部保留，其余 @ 规则（如 @keyframes）丢弃
+    只做简单的块级解析，适用于主题中的常规 CSS；返回压缩空白后的 CSS
+    """
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    pattern = re.compile(r'^(?:' + '|'.join(re.escape(selector) for selector in selectors) + r')(?![\w-])')
+    rules = []
+    pos = 0
+    while True:
+        start = css.find('{', pos)
+        if start == -1:
+            break
+        # 找到与之匹配的右括号
+        depth, end = 1, start + 1
+        while end < len(css) and depth:
+            depth += {'{': 1, '}': -1}.get(css[end], 0)
+            end += 1
+        prelude = ' '.join(css[pos:start].split())
+        body = css[start + 1:end - 1]
+        pos = end
         
-        return html
-    
-    def generate_media_html(self, album, media):
-        """生成媒体查看页面HTML"""
-        html = f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{media['name']} - {album['display_name']} - {self.title}</title>
-    <link rel="stylesheet" href="style.css">
-    <link rel="icon" type="image/x-icon" href="favicon.ico">
-    <meta name="description" content="媒体文件 - {media['name']}">
-    <meta name="robots" content="index, follow">
-    <link rel="preload" href="style.css" as="style">
-    <link rel="preload" href="enhancements.js" as="script">
-</head>
-<body>
-    <div class="header">
-        <h1>{self.title}</h1>
-    </div>
+        if prelude.startswith('@media'):
+            inner = extract_critical_css(body, selectors)
+            if inner:
+                rules.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@font-face'):
+            rules.append(f"{prelude}{{{' '.join(body.split())}}}")
+        elif not prelude.startswith('@'):
+            kept = [selector.strip() for selector in prelude.split(',')
+                    if pattern.match(selector.strip()) and ':hover' not in selector]
+            if kept:
+                rules.append(f"{','.join(kept)}{{{' '.join(body.split())}}}")
+    return ''.join(rules)
 
-    <div class="main">
-        <div class="breadcrumb">
-            <a href="index.html">首页</a> / <a href="album_{album['name'].replace(' ', '_')}.html">{album['display_name']}</a> / <span>{media['name']}</span>
-        </div>
 
-        <div class="media-viewer">
-            <div class="media-content">
-"""
+# 网格卡片图片的 sizes 属性，与 style.css 中的响应式列数对应
+GRID_IMAGE_SIZES = '(max-width: 600px) 100vw, (max-width: 900px) 50vw, 400px'
+
+# 视频扩展名对应的 MIME 类型
+VIDEO_MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.ogg': 'video/ogg',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+}
+
+
+class GalleryBuilder:
+    def __init__(self, config_path="config.json", profiler=None, shard=None):
+        self.config_path = Path(config_path)
+        self.profiler = profiler or BuildProfiler()
+        # 分片构建：(i, N) 表示只处理第 i 个分片（从 1 开始，共 N 个）的相册，首页由 --merge 生成
+        self.shard = shard
+        with open(config_path, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        
+        self.input_dir = Path(self.config['input'])
+        self.output_dir = Path(self.config['output'])
+        self.title = self.config.get('title', 'Image Gallery')
+        self.footer = self.config.get('footer', 'Gallery')
+        self.footer_link = self.config.get('footer-link', '#')
+        
+        # 字体配置
+        self.title_font = self.config.get('title-font', '')
+        self.footer_font = self.config.get('footer-font', '')
+        self.global_font = self.config.get('global-font', '')
+        
+        # 版权年份配置
+        self.start_year = self.config.get('start-year', None)
+        self.start_date = self.config.get('start-date', None)
+        
+        # 预压缩配置：为生成的文本文件写入 .gz/.br 副本，供 nginx gzip_static 等直接使用
+        self.precompress = self.config.get('precompress', False)
+        
+        # 资源指纹：主题文件名包含内容哈希，并生成长期缓存的响应头配置
+        self.fingerprint_assets = self.config.get('fingerprint-assets', False)
+        self.theme_assets = None
+        # 没有构建清单时，输出目录中旧版本发布的媒体页面 {相册名: [页面]}
+        self.legacy_pages = {}
+        
+        # 把解析后的配置、首屏样式和字体声明内联到页面中，省去运行时读取 config.json 的请求
+        self.inline_config = self.config.get('inline-config', False)
+        self.font_display = self.config.get('font-display', 'swap')
+        
+        # 按页面实际使用的字符裁剪自定义字体并转换为 WOFF2
+        self.font_subset = self.config.get('font-subset', False)
+        if self.font_subset and (fonttools_subset is None or brotli is None):
+            print("⚠️  警告: 字体裁剪需要 fonttools 和 brotli（pip install fonttools brotli），将直接复制原字体")
+            self.font_subset = False
+        self.gzip_level = self.config.get('gzip-level', 9)
+        self.brotli_quality = self.config.get('brotli-quality', 11)
+        
+        # 相册分页配置：大于0时每页生成独立的静态页面（album_<name>_p<N>.html）
+        self.page_size = self.config.get('page-size', 0)
+        
+        # 相册渲染方式：html 直接输出所有卡片；virtual 输出 JSON 清单，由浏览器虚拟滚动渲染
+        self.album_render = self.config.get('album-render', 'html')
+        
+        # 缩略图配置
+        self.thumbnail_widths = self.config.get('thumbnail-widths', [320, 640, 1280])
+        self.thumbnail_quality = self.config.get('thumbnail-quality', 82)
+        
+        # 现代格式转码配置，如 ["avif", "webp"]
+        self.transcode_formats = [name for name in TRANSCODE_FORMATS if name in self.config.get('transcode-formats', [])]
+        self.transcode_quality = self.config.get('transcode-quality', 80)
+        
+        # 内联到网格卡片背景中的模糊占位图，最长边像素数
+        self.image_placeholders = self.config.get('image-placeholders', False)
+        self.image_placeholder_size = self.config.get('image-placeholder-size', 16)
+        if self.image_placeholders and 'webp' not in get_supported_transcode_formats():
+            print("⚠️  警告: 当前 Pillow 不支持编码 WebP，不生成模糊占位图")
+            self.image_placeholders = False
+        
+        # 视频封面提取：auto | ffmpeg | placeholder
+        self.video_posters = self.config.get('video-posters', 'auto')
+        self.video_poster_width = self.config.get('video-poster-width', 640)
+        self.poster_extractor = self.get_poster_extractor()
+        
+        # 增量构建配置：启用后修改时间变化的文件会按内容哈希再次确认
+        self.cache_hash = self.config.get('cache-hash', False)
+        
+        # 重复文件检测：内容相同的文件只发布一次；可选按感知哈希报告相似图片
+        self.dedupe = self.config.get('dedupe', False)
+        self.dedupe_perceptual = self.config.get('dedupe-perceptual', False)
+        self.dedupe_threshold = min(15, max(0, int(self.config.get('dedupe-threshold', 4))))
+        
+        # 构建方式：pipeline 按相册流水线处理（扫描 → 发布 → 派生 → 页面，阶段之间用有界队列连接）；
+        # phased 每个阶段处理完所有相册后再进入下一阶段。dedupe 需要先得到全部媒体的哈希，只能按阶段构建
+        self.build_mode = self.config.get('build-mode', 'pipeline')
+        if self.build_mode not in ('pipeline', 'phased'):
+            print(f"⚠️  警告: 未知的 build-mode '{self.build_mode}'，将使用 pipeline")
+            self.build_mode = 'pipeline'
+        if self.build_mode == 'pipeline' and self.dedupe:
+            self.build_mode = 'phased'
+        self.pipeline_queue = max(1, int(self.config.get('pipeline-queue', 4)))
+        
+        # 客户端搜索：生成按词分片的搜索索引，search-exif 启用后同时索引相机型号
+        self.search = self.config.get('search', False)
+        self.search_exif = self.config.get('search-exif', False)
+        
+        # 旧媒体页面地址除了写入 _redirects/redirects.json，是否还在原位置生成跳转页面
+        self.redirect_pages = self.config.get('redirect-pages', False)
+        self.cache = None
+        self.placeholder_index = None
+        self.cache_filename = BuildCache.FILENAME
+        if shard is not None:
+            self.cache_filename = f".gallery-cache.shard-{shard[0]}-of-{shard[1]}.json"
+        self.changes = None
+        self.templates = None
+        # 上次构建的扫描结果，监视模式下只重新扫描变化的相册
+        self.albums = None
+        
+        # 媒体发布方式：copy | hardlink | symlink | reflink
+        self.media_publish = self.config.get('media-publish', 'copy')
+        if self.media_publish not in MEDIA_PUBLISH_MODES:
+            print(f"⚠️  警告: 未知的 media-publish '{self.media_publish}'，将使用 copy")
+            self.media_publish = 'copy'
+        # 配置的发布方式；运行时回退为复制不影响构建清单中记录的设置
+        self.configured_publish = self.media_publish
+        self.publish_lock = threading.Lock()
+        
+        # 复制引擎：copy-workers 为复制线程数上限，不小于 copy-large-file（MB）的文件按吞吐量自适应限制并发；
+        # copy-verify 启用后复制完成时按 SHA-256 校验目标文件
+        self.copy_workers = max(1, int(self.config.get('copy-workers', 8)))
+        self.copy_engine = CopyEngine(
+            max_workers=self.copy_workers,
+            large_file_size=int(self.config.get('copy-large-file', 64)) * 1024 * 1024,
+            verify=self.config.get('copy-verify', False),
+        )
+        
+        # 输入目录为项目根目录（默认配置 "./"）时，跳过输出目录和项目自身的目录
+        self.exclude = set(self.config.get('exclude', []))
+        # 是否把相册内的子目录作为子相册；scan-workers 为并行扫描相册的线程数
+        self.nested_albums = self.config.get('nested-albums', False)
+        self.scan_workers = max(1, int(self.config.get('scan-workers', 8)))
+        
+        # 相册内媒体排序方式：name（文件名）| date（拍摄时间，没有 EXIF 时使用修改时间）
+        self.sort_by = self.config.get('sort-by', 'name')
+        if self.sort_by not in ('name', 'date'):
+            print(f"⚠️  警告: 未知的 sort-by '{self.sort_by}'，将按文件名排序")
+            self.sort_by = 'name'
+        self.excluded_paths = {
+            os.path.realpath(path) for path in (self.output_dir, 'themes', 'assets')
+        }
+    
+    def get_copyright_year(self):
+        """生成版权年份字符串"""
+        current_year = datetime.now().year
+        
+        # 优先使用start-date，如果没有则使用start-year
+        start_year = None
+        
+        if self.start_date:
+            try:
+                # 解析日期字符串，支持多种格式
+                if isinstance(self.start_date, str):
+                    # 尝试解析 YYYY-MM-DD 格式
+                    if '-' in self.start_date:
+                        parsed_date = datetime.strptime(self.start_date, '%Y-%m-%d')
+                        start_year = parsed_date.year
+                    # 尝试解析 YYYY/MM/DD 格式
+                    elif '/' in self.start_date:
+                        parsed_date = datetime.strptime(self.start_date, '%Y/%m/%d')
+                        start_year = parsed_date.year
+                    # 尝试解析 YYYY.MM.DD 格式
+                    elif '.' in self.start_date:
+                        parsed_date = datetime.strptime(self.start_date, '%Y.%m.%d')
+                        start_year = parsed_date.year
+                    else:
+                        # 如果只是年份字符串
+                        start_year = int(self.start_date)
+                else:
+                    start_year = int(self.start_date)
+            except (ValueError, TypeError):
+                print(f"⚠️  警告: 无法解析start-date '{self.start_date}'，将忽略此配置")
+                start_year = None
+        
+        # 如果没有start_date，使用start_year
+        if start_year is None and self.start_year is not None:
+            start_year = self.start_year
+        
+        # 生成版权年份字符串
+        if start_year is None:
+            # 如果没有设置开始年份，只显示当前年份
+            return str(current_year)
+        
+        # 验证年份范围的合理性
+        if start_year > current_year:
+            print(f"⚠️  警告: 开始年份 {start_year} 大于当前年份 {current_year}，将使用当前年份")
+            return str(current_year)
+        
+        # 如果设置了开始年份
+        if start_year == current_year:
+            # 如果开始年份等于当前年份，只显示当前年份
+            return str(current_year)
+        else:
+            # 否则显示年份范围
+            return f"{start_year}-{current_year}"
+        
+    def get_media_type(self, file_path):
+        """判断媒体类型"""
+        ext = os.path.splitext(file_path)[1].lower()
+        
+        if ext in VIDEO_EXTENSIONS:
+            return 'video'
+        elif ext in IMAGE_EXTENSIONS:
+            return 'image'
+        return 'unknown'
+    
+    def is_excluded_dir(self, entry):
+        """判断输入目录下的子目录是否应跳过（隐藏目录、输出目录、主题和资源目录等）"""
+        if entry.name.startswith('.') or entry.name in EXCLUDED_DIR_NAMES or entry.name in self.exclude:
+            return True
+        return os.path.realpath(entry) in self.excluded_paths
+    
+    def parse_album_name(self, folder_name):
+        """
+        解析相册文件夹名称，提取序号和显示名称
+        支持格式：
+        - "01-相册名" -> (1, "相册名", "01-相册名")
+        - "001_相册名" -> (1, "相册名", "001_相册名")
+        - "相册名" -> (None, "相册名", "相册名")
+        """
+        # 尝试匹配开头的序号模式：数字 + 分隔符（-、_、空格、.）
+        match = re.match(r'^(\d+)[-_\.\s]+(.+)$', folder_name)
+        
+        if match:
+            order = int(match.group(1))
+            display_name = match.group(2)
+            return (order, display_name, folder_name)
+        else:
+            # 没有序号，使用原名称
+            return (None, folder_name, folder_name)
+    
+    def scan_album(self, path, name, parents=()):
+        """
+        扫描单个相册目录，返回 (相册记录, 子相册列表)
+        使用 os.scandir：DirEntry 自带文件类型并缓存 stat，每个文件只 stat 一次
+        启用 nested-albums 时，子目录作为子相册返回，相册名为相对输入目录的路径（如 "旅行/2024"）
+        """
+        order, display_name, folder_name = self.parse_album_name(os.path.basename(path))
+        sort_key = parents + ((order is None, order if order is not None else 0, display_name),)
+        
+        album = {
+            'name': name,  # 原始文件夹名（用于文件路径），子相册为相对路径
+            'display_name': display_name,  # 显示名称（隐藏序号）
+            'order': order,  # 排序序号
+            'sort_key': sort_key,  # 子相册排在父相册之后
+            'path': Path(path),
+            'media': [],
+            'thumbnail': None,
+            'cover': None,
+            'count': 0
+        }
+        if parents:
+            parent_display = ' / '.join(key[2] for key in parents)
+            album['display_name'] = f"{parent_display} / {display_name}"
+        
+        # 检查是否有配置的封面
+        album_config = self.config.get('galleries', {}).get(name, {})
+        cover_path = album_config.get('cover', '')
+        
+        if cover_path:
+            # 处理封面路径
+            if cover_path.startswith('http'):
+                # 完整URL
+                album['cover'] = cover_path
+            elif cover_path.startswith('/'):
+                # 相对路径，去掉开头的斜杠
+                album['cover'] = cover_path[1:]
+            else:
+                # 相对路径
+                album['cover'] = cover_path
+        
+        # 扫描相册内的媒体文件
+        subdirs = []
+        media_entries = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if self.nested_albums and not self.is_excluded_dir(entry):
+                        subdirs.append((entry.path, f"{name}/{entry.name}", sort_key))
+                elif entry.is_file() and self.get_media_type(entry.name) in ('image', 'video'):
+                    media_entries.append(entry)
+        
+        media_entries.sort(key=lambda x: x.name)  # 按文件名排序确保顺序一致
+        for entry in media_entries:
+            stat = entry.stat()
+            album['media'].append({
+                'name': entry.name,
+                'path': Path(entry.path),
+                'type': self.get_media_type(entry.name),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'modified': datetime.fromtimestamp(stat.st_mtime),
+                'outputs': []
+            })
+        
+        # 设置相册缩略图（第一个文件）
+        if album['media']:
+            album['thumbnail'] = album['media'][0]
+        album['count'] = len(album['media'])
+        return album, subdirs
+    
+    def in_shard(self, name):
+        """
+        判断相册是否属于本分片：按顶层相册目录名的哈希分配，子相册与父相册在同一分片，
+        分配结果与机器和扫描顺序无关
+        """
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        top_level = name.split('/')[0]
+        return int(hashlib.sha256(top_level.encode('utf-8')).hexdigest()[:8], 16) % count == index - 1
+    
+    def iter_albums(self):
+        """
+        在线程池中并行扫描各相册，扫描完一个就产出一个相册记录（顺序不固定）
+        对 NFS 等高延迟文件系统，多个目录的 scandir/stat 可以同时等待；
+        子相册在父目录扫描完成后立即提交，后续阶段无需等待整个扫描结束即可开始
+        """
+        with self.profiler.wrap_executor(ThreadPoolExecutor(max_workers=self.scan_workers)) as executor:
+            pending = set()
+            with os.scandir(self.input_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir() and not self.is_excluded_dir(entry) and self.in_shard(entry.name):
+                        pending.add(executor.submit(self.scan_album, entry.path, entry.name))
+            
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    album, subdirs = future.result()
+                    for sub_path, sub_name, parents in subdirs:
+                        pending.add(executor.submit(self.scan_album, sub_path, sub_name, parents))
+                    if album['count'] > 0:
+                        yield album
+    
+    def scan_gallery(self):
+        """扫描画廊目录，获取所有相册和媒体文件"""
+        albums = list(self.iter_albums())
+        
+        # 排序：有序号的按序号排序，没有序号的按名称排序，有序号的排在前面；子相册紧跟父相册
+        albums.sort(key=lambda x: x['sort_key'])
+        return albums
+    
+    def rescan_albums(self, names):
+        """
+        只重新扫描指定的相册，其余相册沿用上次构建保存在内存中的扫描结果（监视模式）
+        返回排序后的完整相册列表
+        """
+        albums = {album['name']: album for album in self.albums if album['name'] not in names}
+        for album in albums.values():
+            # 各阶段会重新登记输出文件
+            for media in album['media']:
+                media['outputs'] = []
+        
+        for name in names:
+            path = self.input_dir / name
+            if not path.is_dir():
+                continue
+            parents = ()
+            for part in name.split('/')[:-1]:
+                order, display_name, _ = self.parse_album_name(part)
+                parents += ((order is None, order if order is not None else 0, display_name),)
+            album, _ = self.scan_album(str(path), name, parents)
+            if album['count'] > 0:
+                albums[name] = album
+        return sorted(albums.values(), key=lambda x: x['sort_key'])
+    
+    def read_metadata(self, albums, executor=None):
+        """
+        读取图片尺寸、拍摄时间和方向，结果保存在 media['meta'] 中并随构建清单缓存，
+        源文件未变化时不再打开文件；返回实际读取的文件数
+        """
+        tasks = [
+            media for album in albums for media in album['media']
+            if media['type'] == 'image' and ('meta' not in media or (self.search_exif and 'camera' not in media['meta']))
+            and os.path.splitext(media['name'])[1].lower() in METADATA_EXTENSIONS
+        ]
+        
+        if tasks and Image is None:
+            print("⚠️  警告: 未安装 Pillow，跳过图片元数据读取（pip install Pillow）")
+            tasks = []
+        
+        if tasks:
+            # 只读取文件头，耗时主要在文件系统延迟上，使用线程池
+            with self.get_executor(executor, ThreadPoolExecutor, min(self.scan_workers, len(tasks))) as pool:
+                futures = {pool.submit(read_image_metadata, media['path']): media for media in tasks}
+                for future in as_completed(futures):
+                    media = futures[future]
+                    try:
+                        media['meta'] = future.result()
+                    except Exception as e:
+                        print(f"   错误: {media['name']}: {e}")
+        
+        for album in albums:
+            for media in album['media']:
+                meta = media.get('meta')
+                if meta:
+                    media['width'] = meta['width']
+                    media['height'] = meta['height']
+                    if meta.get('taken'):
+                        media['taken'] = datetime.fromisoformat(meta['taken'])
+            
+            if self.sort_by == 'date':
+                album['media'].sort(key=lambda media: (self.get_media_date(media), media['name']))
+                album['thumbnail'] = album['media'][0]
+        return len(tasks)
+    
+    def find_duplicates(self, albums):
+        """
+        并行计算所有媒体的内容哈希（启用 dedupe-perceptual 时同时计算图片的感知哈希），结果随构建清单缓存；
+        返回内容完全相同的分组 {内容哈希: [媒体, ...]}，重复文件和相似图片写入输出目录下的报告
+        """
+        all_media = [(album, media) for album in albums for media in album['media']]
+        hash_tasks = [media for _, media in all_media if not media.get('hash')]
+        if hash_tasks:
+            print(f"#️⃣  计算 {len(hash_tasks)} 个文件的内容哈希...")
+            # hashlib 处理大块数据时会释放 GIL，读文件和计算哈希可以在线程中并行
+            with ThreadPoolExecutor(max_workers=min(self.scan_workers, len(hash_tasks))) as executor:
+                hashes = executor.map(lambda media: hash_file(media['path']), hash_tasks)
+                for media, content_hash in zip(hash_tasks, hashes):
+                    media['hash'] = content_hash
+        
+        groups = {}
+        for album, media in all_media:
+            groups.setdefault(media['hash'], []).append((album, media))
+        duplicates = {content_hash: group for content_hash, group in groups.items() if len(group) > 1}
+        
+        similar = []
+        if self.dedupe_perceptual:
+            similar = self.find_similar_images(all_media)
+        
+        report = {
+            'duplicates': [
+                [f"{album['name']}/{media['name']}" for album, media in group] for group in duplicates.values()
+            ],
+            'similar': [{'a': a, 'b': b, 'distance': distance} for a, b, distance in similar],
+        }
+        with open(self.output_dir / '.gallery-duplicates.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
+        if duplicates:
+            saved = sum(group[0][1]['size'] * (len(group) - 1) for group in duplicates.values())
+            print(f"♊ 发现 {len(duplicates)} 组重复文件，合并发布节省 {saved / 1048576:.1f}MB")
+        if similar:
+            print(f"🔍 发现 {len(similar)} 对相似图片（汉明距离 ≤ {self.dedupe_threshold}）:")
+            for a, b, distance in similar[:10]:
+                print(f"   {a} ≈ {b}（距离 {distance}）")
+            if len(similar) > 10:
+                print(f"   ……完整列表见 {self.output_dir / '.gallery-duplicates.json'}")
+        return {content_hash: [media for _, media in group] for content_hash, group in duplicates.items()}
+    
+    def find_similar_images(self, all_media):
+        """在进程池中计算图片的感知哈希，返回相似图片对 [(路径A, 路径B, 汉明距离), ...]"""
+        if Image is None:
+            print("⚠️  警告: 未安装 Pillow，跳过相似图片检测")
+            return []
+        
+        phash_tasks = [
+            media for _, media in all_media
+            if media['type'] == 'image' and 'phash' not in media
+            and os.path.splitext(media['name'])[1].lower() in METADATA_EXTENSIONS
+        ]
+        if phash_tasks:
+            with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(phash_tasks))) as executor:
+                futures = {executor.submit(perceptual_hash, str(media['path'])): media for media in phash_tasks}
+                for future in as_completed(futures):
+                    media = futures[future]
+                    try:
+                        media['phash'] = future.result()
+                    except Exception as e:
+                        print(f"   错误: {media['name']}: {e}")
+        
+        # 内容完全相同的文件已经合并，只取其中一个参与比较
+        hashes = {}
+        seen = set()
+        for album, media in all_media:
+            # 纯色图片的哈希全为 0，没有比较意义
+            if media.get('phash', '').strip('0') and media['hash'] not in seen:
+                seen.add(media['hash'])
+                hashes[f"{album['name']}/{media['name']}"] = media['phash']
+        return find_similar_pairs(hashes, self.dedupe_threshold)
+    
+    def assign_media_locations(self, albums, duplicates=None):
+        """
+        确定每个媒体在输出目录中的位置：重复文件共用 media/<哈希><扩展名>，其余与相册相同
+        位置与上次构建不同时（例如新出现了重复文件或关闭了 dedupe），不能沿用上次的发布结果和缩略图
+        """
+        canonical = {
+            content_hash: ('media', f"{content_hash[:16]}{group[0]['path'].suffix.lower()}")
+            for content_hash, group in (duplicates or {}).items()
+        }
+        for album in albums:
+            for media in album['media']:
+                default = (album['name'], media['name'])
+                location = canonical.get(media.get('hash'), default)
+                if media.get('cached') and tuple(media.get('location') or default) != location:
+                    media['cached'] = False
+                    media.pop('thumbnails', None)
+                    media.pop('transcoded', None)
+                media['location'] = list(location)
+    
+    def get_executor(self, executor, executor_class, max_workers):
+        """流水线构建时各相册共用传入的执行器，否则为本阶段新建一个"""
+        if executor is not None:
+            return nullcontext(executor)
+        return executor_class(max_workers=max_workers)
+    
+    def get_media_date(self, media):
+        """媒体的显示日期：优先使用 EXIF 拍摄时间，否则使用文件修改时间"""
+        return media.get('taken') or media['modified']
+    
+    def is_published(self, src_path, dest_path):
+        """
+        判断目标文件是否已经是按当前发布方式得到的源文件发布结果：symlink 要求指向源文件的符号链接，
+        hardlink 要求与源文件是同一文件，copy/reflink 要求大小和修改时间一致的独立副本
+        """
+        mode = self.media_publish
+        try:
+            if dest_path.is_symlink():
+                return mode == 'symlink' and os.path.realpath(dest_path) == os.path.realpath(src_path)
+            if mode == 'symlink':
+                return False
+            if os.path.samefile(src_path, dest_path):
+                return mode == 'hardlink'
+            if mode == 'hardlink':
+                return False
+            src_stat = src_path.stat()
+            dest_stat = dest_path.stat()
+        except OSError:
+            return False
+        return src_stat.st_size == dest_stat.st_size and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+    
+    def publish_file(self, src_path, dest_path, known_hash=None):
+        """
+        按 media-publish 配置发布单个文件，返回 (实际使用的方式, 复制的字节数, 复制耗时)
+        硬链接跨设备、文件系统不支持 reflink 等情况下自动回退为复制
+        """
+        # 目标可能是旧的链接，先删除，避免写穿到源文件
+        if dest_path.exists() or dest_path.is_symlink():
+            dest_path.unlink()
+        
+        mode = self.media_publish
+        try:
+            if mode == 'hardlink':
+                os.link(src_path, dest_path)
+                return mode, 0, 0
+            if mode == 'symlink':
+                os.symlink(os.path.abspath(src_path), dest_path)
+                return mode, 0, 0
+            if mode == 'reflink':
+                if fcntl is None:
+                    raise OSError('当前平台不支持 reflink')
+                with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+                    fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                shutil.copystat(src_path, dest_path)
+                return mode, 0, 0
+        except OSError as e:
+            if dest_path.exists() or dest_path.is_symlink():
+                dest_path.unlink()
+            # 之后的文件直接复制，不再重复尝试
+            with self.publish_lock:
+                if self.media_publish != 'copy':
+                    print(f"   ⚠️  无法使用 {mode} 发布媒体文件（{e}），回退为复制")
+                    self.media_publish = 'copy'
+        
+        copied, seconds, method = self.copy_engine.copy(src_path, dest_path, known_hash)
+        return method, copied, seconds
+    
+    def get_media_location(self, album, media):
+        """媒体在输出目录中的位置 (目录, 文件名)：默认与相册相同，重复文件位于 media/<哈希><扩展名>"""
+        if media.get('location'):
+            return tuple(media['location'])
+        return album['name'], media['name']
+    
+    def copy_media_files(self, albums, executor=None):
+        """并行发布（复制或链接）媒体文件到输出目录，位置相同的重复文件只发布一次，返回实际发布的文件数"""
+        def copy_single_media(task):
+            directory, name, group = task
+            media = group[0]
+            dest_dir = self.output_dir / directory
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            
+            dest_path = dest_dir / name
+            if self.cache_hash and not media.get('hash'):
+                media['hash'] = hash_file(media['path'])
+            
+            # 构建清单缺失时，已链接或已复制的文件不再重复发布
+            if self.is_published(media['path'], dest_path):
+                return 0
+            
+            try:
+                mode, copied, seconds = self.publish_file(media['path'], dest_path, media.get('hash'))
+            except Exception:
+                # 删除复制了一半的文件，下次构建重新发布
+                if dest_path.exists() or dest_path.is_symlink():
+                    dest_path.unlink()
+                raise
+            if copied >= self.copy_engine.large_file_size:
+                print(f"   {media['name']}: {copied / 1024 / 1024:.1f}MB，{copied / 1024 / 1024 / max(seconds, 1e-6):.1f}MB/s（{mode}）")
+            return copied
+        
+        # 发布方式变化时，未变化的媒体也要按新的方式重新发布（已符合新方式的文件由 is_published 跳过）
+        # 不经过 build() 直接调用时（如基准测试）没有构建清单
+        republish = False
+        if self.cache is not None:
+            republish = self.cache.previous.get('settings', {}).get('publish') != self.cache.settings.get('publish')
+        
+        # 准备所有复制任务（源文件与上次构建相同时跳过复制），输出位置相同的媒体共用一个任务
+        copy_tasks = {}
+        for album in albums:
+            for media in album['media']:
+                directory, name = self.get_media_location(album, media)
+                output = f"{directory}/{name}"
+                # URL编码文件名以处理特殊字符（如#）
+                media['url'] = f"{directory}/{urllib.parse.quote(name, safe='')}"
+                if media.get('cached') and not republish:
+                    media['outputs'].append(output)
+                else:
+                    copy_tasks.setdefault(output, (directory, name, []))[2].append(media)
+        
+        # 复制成功后才把输出文件记入构建清单
+        copy_tasks = list(copy_tasks.items())
+        if not copy_tasks:
+            return 0
+        
+        # 并行执行复制任务；大文件在单独的线程池中按复制引擎的并发限制执行，不占用小文件的线程
+        print(f"📋 开始并行发布 {len(copy_tasks)} 个媒体文件（{self.media_publish}）...")
+        start_time = time.time()
+        large_tasks = [task for _, task in copy_tasks if task[2][0]['size'] >= self.copy_engine.large_file_size]
+        
+        with self.get_executor(executor, ThreadPoolExecutor, min(self.copy_workers, len(copy_tasks))) as pool, \
+                ThreadPoolExecutor(max_workers=max(1, min(self.copy_workers, len(large_tasks)))) as large_pool:
+            futures = {
+                (large_pool if task[2][0]['size'] >= self.copy_engine.large_file_size else pool).submit(
+                    copy_single_media, task): (output, task[2])
+                for output, task in copy_tasks
+            }
+            
+            completed = 0
+            copied = 0
+            for future in as_completed(futures):
+                output, group = futures[future]
+                try:
+                    copied += future.result()
+                    for media in group:
+                        media['outputs'].append(output)
+                    completed += 1
+                    if completed % 10 == 0 or completed == len(copy_tasks):
+                        print(f"   进度: {completed}/{len(copy_tasks)}，"
+                              f"{copied / 1024 / 1024 / max(time.time() - start_time, 1e-6):.1f}MB/s")
+                except Exception as e:
+                    for media in group:
+                        media['failed'] = True
+                    print(f"   错误: {group[0]['name']}: {e}")
+        
+        elapsed = time.time() - start_time
+        if copied:
+            print(f"✅ 媒体文件复制完成，耗时: {elapsed:.2f}秒，复制 {copied / 1024 / 1024:.1f}MB，"
+                  f"平均 {copied / 1024 / 1024 / max(elapsed, 1e-6):.1f}MB/s（大文件并发 {self.copy_engine.limit}）")
+        else:
+            print(f"✅ 媒体文件复制完成，耗时: {elapsed:.2f}秒")
+        return len(copy_tasks)
+    
+    def generate_thumbnails(self, albums, executor=None):
+        """
+        在进程池中并行生成多尺寸缩略图（解码和缩放是CPU密集型任务，线程池会受GIL限制）
+        返回实际处理的图片数
+        """
+        if Image is None:
+            print("⚠️  警告: 未安装 Pillow，跳过缩略图生成")
+            return 0
+        if not self.thumbnail_widths:
+            return 0
+        
+        # 准备所有缩略图任务，输出位置相同的重复文件只生成一次
+        thumbnail_tasks = {}
+        for album in albums:
+            for media in album['media']:
+                if media['type'] == 'image' and media['path'].suffix.lower() in THUMBNAIL_EXTENSIONS:
+                    directory, name = self.get_media_location(album, media)
+                    if media.get('cached') and 'thumbnails' in media:
+                        # 源文件未变化，沿用上次生成的缩略图
+                        media['outputs'].extend(
+                            f"thumbnails/{directory}/{name}_{width}.jpg"
+                            for width, height, url in media['thumbnails']
+                        )
+                        continue
+                    thumbnail_tasks.setdefault((directory, name), []).append(media)
+        
+        if not thumbnail_tasks:
+            return 0
+        
+        print(f"🖼️  开始并行生成 {len(thumbnail_tasks)} 张图片的缩略图...")
+        start_time = time.time()
+        
+        for directory, name in thumbnail_tasks:
+            (self.output_dir / 'thumbnails' / directory).mkdir(parents=True, exist_ok=True)
+        
+        with self.get_executor(executor, ProcessPoolExecutor, min(os.cpu_count() or 1, len(thumbnail_tasks))) as pool:
+            futures = {
+                pool.submit(render_thumbnails, str(group[0]['path']), str(self.output_dir / 'thumbnails' / directory),
+                                self.thumbnail_widths, self.thumbnail_quality, name): (directory, group)
+                for (directory, name), group in thumbnail_tasks.items()
+            }
+            
+            completed = 0
+            for future in as_completed(futures):
+                directory, group = futures[future]
+                try:
+                    thumbnails = future.result()
+                    for media in group:
+                        media['thumbnails'] = [
+                            (thumb_width, thumb_height,
+                             f"thumbnails/{urllib.parse.quote(directory)}/{urllib.parse.quote(filename, safe='')}")
+                            for thumb_width, thumb_height, filename in thumbnails
+                        ]
+                        media['outputs'].extend(f"thumbnails/{directory}/{filename}" for _, _, filename in thumbnails)
+                    completed += 1
+                    if completed % 10 == 0 or completed == len(thumbnail_tasks):
+                        print(f"   进度: {completed}/{len(thumbnail_tasks)}")
+                except Exception as e:
+                    for media in group:
+                        media['failed'] = True
+                    print(f"   错误: {group[0]['name']}: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 缩略图生成完成，耗时: {elapsed:.2f}秒")
+        return len(thumbnail_tasks)
+    
+    def transcode_images(self, albums, executor=None):
+        """在进程池中把图片并行转码为 WebP/AVIF，结果按源文件内容哈希缓存，返回实际处理的图片数"""
+        if not self.transcode_formats:
+            return 0
+        supported = get_supported_transcode_formats()
+        formats = [name for name in self.transcode_formats if name in supported]
+        for name in self.transcode_formats:
+            if name not in supported:
+                print(f"⚠️  警告: 当前 Pillow 不支持编码 {name}，跳过此格式")
+        if not formats:
+            return 0
+        
+        # 准备所有转码任务，输出位置相同的重复文件只转码一次
+        transcode_tasks = {}
+        for album in albums:
+            for media in album['media']:
+                extension = media['path'].suffix.lower()
+                if media['type'] != 'image' or extension not in THUMBNAIL_EXTENSIONS:
+                    continue
+                # 原图已经是目标格式时无需转码
+                media_formats = [name for name in formats if TRANSCODE_FORMATS[name][1] != extension]
+                if not media_formats:
+                    continue
+                location = self.get_media_location(album, media)
+                if media.get('cached') and 'transcoded' in media:
+                    # 源文件未变化，沿用上次转码结果
+                    media['outputs'].extend(
+                        f"optimized/{location[0]}/{filename}" for name, filename in media['transcoded']
+                    )
+                    continue
+                transcode_tasks.setdefault(location, (media_formats, []))[1].append(media)
+        
+        if not transcode_tasks:
+            return 0
+        
+        print(f"🔄 开始并行转码 {len(transcode_tasks)} 张图片（{', '.join(formats)}）...")
+        start_time = time.time()
+        
+        for directory, name in transcode_tasks:
+            (self.output_dir / 'optimized' / directory).mkdir(parents=True, exist_ok=True)
+        
+        with self.get_executor(executor, ProcessPoolExecutor, min(os.cpu_count() or 1, len(transcode_tasks))) as pool:
+            futures = {
+                pool.submit(transcode_image, str(group[0]['path']), str(self.output_dir / 'optimized' / directory),
+                                media_formats, self.transcode_quality, group[0].get('hash')): (directory, group)
+                for (directory, name), (media_formats, group) in transcode_tasks.items()
+            }
+            
+            completed = 0
+            for future in as_completed(futures):
+                directory, group = futures[future]
+                try:
+                    content_hash, outputs = future.result()
+                    for media in group:
+                        media['hash'] = content_hash
+                        media['transcoded'] = outputs
+                        media['outputs'].extend(f"optimized/{directory}/{filename}" for name, filename in outputs)
+                    completed += 1
+                    if completed % 10 == 0 or completed == len(transcode_tasks):
+                        print(f"   进度: {completed}/{len(transcode_tasks)}")
+                except Exception as e:
+                    for media in group:
+                        media['failed'] = True
+                    print(f"   错误: {group[0]['name']}: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 图片转码完成，耗时: {elapsed:.2f}秒")
+        return len(transcode_tasks)
+    
+    def get_cached_placeholders(self):
+        """上次构建生成的占位图（内容哈希 -> data: URI），占位图配置变化时为空"""
+        if self.placeholder_index is None:
+            previous = self.cache.previous
+            self.placeholder_index = {}
+            if previous.get('settings', {}).get('placeholder') == self.cache.settings.get('placeholder'):
+                self.placeholder_index = {
+                    entry['hash']: entry['placeholder'] for entry in previous['sources'].values()
+                    if entry.get('hash') and entry.get('placeholder')
+                }
+        return self.placeholder_index
+    
+    def generate_placeholders(self, albums, executor=None):
+        """
+        在进程池中生成内联到卡片背景的模糊占位图，结果按源文件内容哈希缓存，
+        改名或移动的图片也能沿用上次的结果；返回实际处理的图片数
+        """
+        if not self.image_placeholders:
+            return 0
+        
+        # 准备所有占位图任务，内容相同的图片只生成一次
+        cached = self.get_cached_placeholders()
+        placeholder_tasks = {}
+        for album in albums:
+            for media in album['media']:
+                if media['type'] != 'image' or media['path'].suffix.lower() not in THUMBNAIL_EXTENSIONS:
+                    continue
+                if media.get('cached') and 'placeholder' in media:
+                    continue
+                if media.get('hash') in cached:
+                    media['placeholder'] = cached[media['hash']]
+                    continue
+                placeholder_tasks.setdefault(media.get('hash') or media['path'], []).append(media)
+        
+        if not placeholder_tasks:
+            return 0
+        
+        print(f"🌫️  开始并行生成 {len(placeholder_tasks)} 张图片的模糊占位图...")
+        start_time = time.time()
+        
+        with self.get_executor(executor, ProcessPoolExecutor, min(os.cpu_count() or 1, len(placeholder_tasks))) as pool:
+            futures = {
+                pool.submit(render_placeholder, str(group[0]['path']), self.image_placeholder_size,
+                            known_hash=group[0].get('hash')): group
+                for group in placeholder_tasks.values()
+            }
+            
+            completed = 0
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    content_hash, placeholder = future.result()
+                    cached[content_hash] = placeholder
+                    for media in group:
+                        media['hash'] = content_hash
+                        media['placeholder'] = placeholder
+                    completed += 1
+                    if completed % 10 == 0 or completed == len(placeholder_tasks):
+                        print(f"   进度: {completed}/{len(placeholder_tasks)}")
+                except Exception as e:
+                    for media in group:
+                        media['failed'] = True
+                    print(f"   错误: {group[0]['name']}: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 模糊占位图生成完成，耗时: {elapsed:.2f}秒")
+        return len(placeholder_tasks)
+    
+    def get_poster_extractor(self):
+        """按 video-posters 配置选择视频封面提取器，不可用时回退为占位图"""
+        if self.video_posters == 'auto':
+            for extractor_class in VIDEO_POSTER_EXTRACTORS.values():
+                if extractor_class.available():
+                    return extractor_class()
+        
+        extractor_class = VIDEO_POSTER_EXTRACTORS.get(self.video_posters)
+        if extractor_class is None:
+            print(f"⚠️  警告: 未知的 video-posters '{self.video_posters}'，将使用占位图")
+        elif not extractor_class.available():
+            print(f"⚠️  警告: 视频封面提取器 {self.video_posters} 不可用（需要安装 ffmpeg），将使用占位图")
+        else:
+            return extractor_class()
+        return PlaceholderPosterExtractor()
+    
+    def extract_video_posters(self, albums, executor=None):
+        """
+        并行提取视频封面和时长，封面按源文件内容哈希保存为 posters/<哈希>.jpg，
+        相同内容的视频共用一张封面；返回实际处理的视频数
+        """
+        if isinstance(self.poster_extractor, PlaceholderPosterExtractor):
+            return 0
+        
+        poster_tasks = []
+        for album in albums:
+            for media in album['media']:
+                if media['type'] != 'video':
+                    continue
+                if media.get('cached') and 'video' in media:
+                    # 源文件未变化，沿用上次的封面和时长
+                    if media['video']['poster']:
+                        media['outputs'].append(media['video']['poster'])
+                    continue
+                poster_tasks.append(media)
+        
+        if not poster_tasks:
+            return 0
+        
+        print(f"🎬 开始提取 {len(poster_tasks)} 个视频的封面（{self.poster_extractor.name}）...")
+        start_time = time.time()
+        poster_dir = self.output_dir / 'posters'
+        poster_dir.mkdir(parents=True, exist_ok=True)
+        
+        def extract_single_poster(media):
+            if not media.get('hash'):
+                media['hash'] = hash_file(media['path'])
+            poster = f"posters/{media['hash'][:16]}.jpg"
+            duration, has_poster = self.poster_extractor.extract(
+                media['path'], self.output_dir / poster, self.video_poster_width)
+            return {'poster': poster if has_poster else None, 'duration': duration}
+        
+        # 提取工作在 ffmpeg 子进程中进行，线程只负责等待
+        with self.get_executor(executor, ThreadPoolExecutor, min(os.cpu_count() or 1, len(poster_tasks))) as pool:
+            futures = {pool.submit(extract_single_poster, media): media for media in poster_tasks}
+            
+            completed = 0
+            for future in as_completed(futures):
+                media = futures[future]
+                try:
+                    media['video'] = future.result()
+                    if media['video']['poster']:
+                        media['outputs'].append(media['video']['poster'])
+                    completed += 1
+                    if completed % 10 == 0 or completed == len(poster_tasks):
+                        print(f"   进度: {completed}/{len(poster_tasks)}")
+                except Exception as e:
+                    # 无法解码的视频使用占位图，源文件变化前不再重试
+                    media['video'] = {'poster': None, 'duration': None}
+                    print(f"   错误: {media['name']}: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 视频封面提取完成，耗时: {elapsed:.2f}秒")
+        return len(poster_tasks)
+    
+    def get_video_poster(self, media):
+        """视频卡片使用的图片：提取的封面，没有时使用共用的占位图"""
+        return (media.get('video') or {}).get('poster') or VIDEO_PLACEHOLDER_URL
+    
+    def get_media_subtitle(self, media):
+        """媒体卡片副标题：日期，视频追加时长"""
+        subtitle = self.get_media_date(media).strftime('%Y-%m-%d')
+        duration = (media.get('video') or {}).get('duration')
+        if duration:
+            subtitle += f" · {format_duration(duration)}"
+        return subtitle
+    
+    def get_image_sources(self, media, preferred_width=640):
+        """返回网格卡片图片的 (src, srcset)，没有缩略图时 srcset 为 None"""
+        thumbnails = media.get('thumbnails')
+        if not thumbnails:
+            return media['url'], None
+        
+        # src 使用不小于目标宽度的最小缩略图，作为不支持 srcset 时的回退
+        # srcset 中不包含原图，避免高分屏设备在网格中下载原图
+        src = next((url for width, height, url in thumbnails if width >= preferred_width), thumbnails[-1][2])
+        srcset = ', '.join(f'{url} {width}w' for width, height, url in thumbnails)
+        return src, srcset
+    
+    def get_image_attrs(self, media, preferred_width=640):
+        """生成网格卡片 <img> 的 src/srcset/sizes/width/height 属性"""
+        src, srcset = self.get_image_sources(media, preferred_width)
+        attrs = f'src="{src}"'
+        if srcset:
+            attrs += f' srcset="{srcset}" sizes="{GRID_IMAGE_SIZES}"'
+        if media.get('width'):
+            # 声明原图尺寸，浏览器在图片加载前按宽高比预留位置，避免网格重排
+            attrs += f' width="{media["width"]}" height="{media["height"]}"'
+        return attrs
+    
+    def get_placeholder_attrs(self, media):
+        """卡片缩略图容器的模糊占位图背景，图片加载完成后由 enhancements.js 移除"""
+        placeholder = media and media.get('placeholder')
+        if not placeholder:
+            return ''
+        return f' data-placeholder style="background-image: url({placeholder})"'
+    
+    def compile_templates(self):
+        """编译本次构建使用的页面模板，标题、页脚和版权年份只计算一次"""
+        static_values = {
+            'title': self.title,
+            'footer': self.footer,
+            'footer_link': self.footer_link,
+            'copyright_year': self.get_copyright_year(),
+        }
+        self.theme_assets = self.prepare_theme_assets()
+        static_values.update(
+            stylesheet=self.get_stylesheet_html(),
+            script=self.theme_assets['enhancements.js'][0],
+            config=self.theme_assets['config.json'][0],
+            search=f' data-search="{SEARCH_INDEX_URL}"' if self.search else '',
+        )
+        self.templates = {
+            'page': PageTemplate(PAGE_TEMPLATE, **static_values),
+            'grid': PageTemplate(GRID_TEMPLATE),
+            'virtual_grid': PageTemplate(VIRTUAL_GRID_TEMPLATE),
+            'pagination': PageTemplate(SERVER_PAGINATION_TEMPLATE),
+            'card': PageTemplate(CARD_TEMPLATE),
+            'video': PageTemplate(VIDEO_TEMPLATE),
+            'media': PageTemplate(MEDIA_TEMPLATE),
+            'media_script': PageTemplate(MEDIA_SCRIPT_TEMPLATE),
+        }
+        return self.templates
+    
+    def resolve_font(self, value):
+        """与 enhancements.js 相同的字体解析规则：brand 使用自定义字体，空值使用系统字体"""
+        if not value or not str(value).strip():
+            return DEFAULT_FONT_STACK
+        if value == 'brand':
+            return f"'Brand', {DEFAULT_FONT_STACK}"
+        return value
+    
+    def get_stylesheet_html(self):
+        """
+        页面 <head> 中的样式部分
+        启用 inline-config 时内联首屏样式、@font-face 和解析后的配置，完整样式表异步加载，
+        并预加载实际使用的自定义字体；否则只输出普通的样式表链接
+        """
+        style_url, style_content = self.theme_assets['style.css']
+        if not self.inline_config:
+            return f'<link rel="stylesheet" href="{style_url}">'
+        
+        critical_css = extract_critical_css(style_content.decode('utf-8'))
+        critical_css = re.sub(r'font-display:\s*[\w-]+', f'font-display: {self.font_display}', critical_css)
+        fonts = {
+            'title-font': self.resolve_font(self.title_font),
+            'footer-font': self.resolve_font(self.footer_font),
+            'global-font': self.resolve_font(self.global_font),
+        }
+        critical_css += ':root{' + ';'.join(f'--{name}: {value}' for name, value in fonts.items()) + '}'
+        
+        # 只保留 enhancements.js 用到的配置项；JSON 中的 </ 转义，避免提前结束 script 标签
+        config = {key: self.config[key] for key in
+                  ('title-font', 'footer-font', 'global-font', 'footer', 'footer-link', 'start-date', 'start-year')
+                  if key in self.config}
+        config_json = json.dumps(config, ensure_ascii=False).replace('</', '<\\/')
+        
+        lines = [
+            f'<style>{critical_css}</style>',
+            f'<script>window.__GALLERY_CONFIG__ = {config_json};</script>',
+        ]
+        if any(value == 'brand' for value in (self.title_font, self.footer_font, self.global_font)):
+            for url in re.findall(r"url\(['\"]?([^'\")]+)['\"]?\)", critical_css):
+                font_type = FONT_MIME_TYPES.get(os.path.splitext(url)[1].lower())
+                if font_type:
+                    lines.append(f'<link rel="preload" href="{url}" as="font" type="{font_type}" crossorigin>')
+        lines += [
+            f'<link rel="preload" href="{style_url}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">',
+            f'<noscript><link rel="stylesheet" href="{style_url}"></noscript>',
+        ]
+        return '\n    '.join(lines)
+    
+    def write_page(self, path, chunks, glyphs=None, previous_hash=None):
+        """
+        把页面片段流式写入临时文件，不在内存中拼接整个页面；glyphs 为集合时同时收集页面中出现的字符
+        内容哈希与 previous_hash 相同且页面已存在时保留原文件（修改时间不变，CDN 和同步工具不会视为变化）
+        返回 (内容哈希, 是否重写了页面)
+        """
+        digest = hashlib.sha256()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                if glyphs is not None:
+                    glyphs.update(chunk)
+                digest.update(chunk.encode('utf-8'))
+                f.write(chunk)
+        
+        content_hash = digest.hexdigest()[:16]
+        if content_hash == previous_hash and os.path.exists(path):
+            os.unlink(tmp_path)
+            return content_hash, False
+        os.replace(tmp_path, path)
+        return content_hash, True
+    
+    def get_album_slug(self, album):
+        """相册在输出根目录中的文件名片段：空格替换为下划线，子相册路径分隔符替换为双下划线"""
+        return album['name'].replace(' ', '_').replace('/', '__')
+    
+    def get_album_page_name(self, album, page=1):
+        """相册页面文件名，分页时第2页起追加 _p<N>"""
+        safe_album_name = self.get_album_slug(album)
+        if page > 1:
+            return f"album_{safe_album_name}_p{page}.html"
+        return f"album_{safe_album_name}.html"
+    
+    def get_album_pages(self, album):
+        """
+        把相册媒体按 page-size 切分为多个页面
+        返回 [(页码, 页面文件名, 起始索引, 结束索引), ...]；未启用分页时只有一页
+        """
+        count = len(album['media'])
+        if not self.page_size or count <= self.page_size or self.album_render == 'virtual':
+            return [(1, self.get_album_page_name(album), 0, count)]
+        return [
+            (page, self.get_album_page_name(album, page), start, min(start + self.page_size, count))
+            for page, start in enumerate(range(0, count, self.page_size), start=1)
+        ]
+    
+    def get_album_manifest_name(self, album):
+        """相册 JSON 清单文件名"""
+        return f"album_{self.get_album_slug(album)}.json"
+    
+    def generate_album_manifest(self, album, media_pages):
+        """由 scan_gallery 生成的相册数据输出紧凑的 JSON 清单，供虚拟滚动网格使用"""
+        items = []
+        for media, media_page in zip(album['media'], media_pages):
+            item = {
+                'name': media['name'],
+                'url': media['url'],
+                'page': media_page,
+                'type': media['type'],
+                'date': self.get_media_date(media).strftime('%Y-%m-%d'),
+            }
+            if media['type'] == 'image':
+                item['src'], srcset = self.get_image_sources(media)
+                if srcset:
+                    item['srcset'] = srcset
+                if media.get('placeholder'):
+                    item['lqip'] = media['placeholder']
+            elif media.get('video'):
+                if media['video']['poster']:
+                    item['poster'] = media['video']['poster']
+                if media['video']['duration']:
+                    item['duration'] = format_duration(media['video']['duration'])
+            if media.get('width'):
+                item['width'] = media['width']
+                item['height'] = media['height']
+            items.append(item)
+        
+        return {
+            'name': album['display_name'],
+            'count': len(items),
+            'sizes': GRID_IMAGE_SIZES,
+            # 没有封面的视频共用主题中的占位图
+            'placeholder': VIDEO_PLACEHOLDER_URL,
+            'items': items,
+        }
+    
+    def get_page_window(self, page, total_pages, radius=2):
+        """分页页码：首页、末页和当前页附近的页码，其余用省略号代替"""
+        pages = sorted({1, total_pages, *range(max(1, page - radius), min(total_pages, page + radius) + 1)})
+        window = []
+        for number in pages:
+            if window and number - window[-1] > 1:
+                window.append(None)
+            window.append(number)
+        return window
+    
+    def render_server_pagination(self, album, page, album_pages):
+        """生成服务端分页控件，上一页/下一页和页码都是真实链接"""
+        total_pages = len(album_pages)
+        _, _, start, end = album_pages[page - 1]
+        
+        if page > 1:
+            prev = (f'<a class="pagination-btn prev-btn" href="{self.get_album_page_name(album, page - 1)}" rel="prev">'
+                    '<svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">'
+                    '<polyline points="15,18 9,12 15,6"></polyline></svg>上一页</a>')
+        else:
+            prev = '<span class="pagination-btn prev-btn disabled" aria-disabled="true">上一页</span>'
+        if page < total_pages:
+            next_link = (f'<a class="pagination-btn next-btn" href="{self.get_album_page_name(album, page + 1)}" rel="next">'
+                         '下一页<svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">'
+                         '<polyline points="9,18 15,12 9,6"></polyline></svg></a>')
+        else:
+            next_link = '<span class="pagination-btn next-btn disabled" aria-disabled="true">下一页</span>'
+        
+        numbers = []
+        for number in self.get_page_window(page, total_pages):
+            if number is None:
+                numbers.append('<span class="pagination-ellipsis">…</span>')
+            elif number == page:
+                numbers.append(f'<span class="pagination-number active" aria-current="page">{number}</span>')
+            else:
+                numbers.append(f'<a class="pagination-number" href="{self.get_album_page_name(album, number)}">{number}</a>')
+        
+        return self.templates['pagination'].render(
+            page=str(page),
+            total_pages=str(total_pages),
+            first_item=str(start + 1),
+            last_item=str(end),
+            total_items=str(len(album['media'])),
+            prev=prev,
+            numbers='\n                    '.join(numbers),
+            next=next_link,
+        )
+    
+    def get_media_page_names(self, album):
+        """
+        相册内各媒体页面的文件名：media_<相册>_<文件名哈希>.html
+        只由相册和文件名决定，与排序位置无关，新增或删除文件不会改变其他媒体页面的地址；
+        同一相册内哈希前缀冲突时改用更长的哈希
+        """
+        # 保留空格以兼容已发布的链接，只替换子相册的路径分隔符
+        album_name = album['name'].replace('/', '__')
+        hashes = [hashlib.md5(media['name'].encode('utf-8')).hexdigest() for media in album['media']]
+        prefixes = {}
+        for media_hash in hashes:
+            prefixes[media_hash[:8]] = prefixes.get(media_hash[:8], 0) + 1
+        return [
+            f"media_{album_name}_{media_hash[:8] if prefixes[media_hash[:8]] == 1 else media_hash[:16]}.html"
+            for media_hash in hashes
+        ]
+    
+    def get_legacy_redirects(self, album, media_pages):
+        """
+        旧地址到固定媒体页面的重定向：上次构建或输出目录中（没有构建清单时）按旧方式
+        （media_<相册>_<序号>_<哈希>.html）发布的页面，以及上次记录的、目标页面仍然存在的重定向
+        """
+        previous = self.cache.previous['albums'].get(album['name'], {})
+        current = set(media_pages)
+        redirects = {old: new for old, new in previous.get('redirects', {}).items() if new in current}
+        
+        album_name = album['name'].replace('/', '__')
+        by_hash = {}
+        for media, media_page in zip(album['media'], media_pages):
+            by_hash[hashlib.md5(media['name'].encode('utf-8')).hexdigest()[:8]] = media_page
+        legacy = re.compile(re.escape(f"media_{album_name}_") + r'\d+_([0-9a-f]{8})\.html')
+        for page in previous.get('pages', []) + self.legacy_pages.get(album['name'], []):
+            match = legacy.fullmatch(page)
+            if match and match.group(1) in by_hash:
+                redirects[page] = by_hash[match.group(1)]
+        return redirects
+    
+    def find_legacy_pages(self, album_names):
+        """
+        输出目录中旧版本发布的媒体页面，按相册分组 {相册名: [页面]}
+        media_a_1_<哈希>.html 同时也是相册 a_1 的固定地址页面，存在相册 a_1 时不作为相册 a 的旧地址
+        """
+        albums = {name.replace('/', '__'): name for name in album_names}
+        pages = {}
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                match = LEGACY_MEDIA_PAGE_PATTERN.fullmatch(entry.name)
+                if (match and match.group(1) in albums
+                        and f"{match.group(1)}_{match.group(2)}" not in albums):
+                    pages.setdefault(albums[match.group(1)], []).append(entry.name)
+        return pages
+    
+    def generate_redirect_page(self, target):
+        """旧地址的跳转页面，供不支持 _redirects 的静态托管（如 GitHub Pages）使用"""
+        url = urllib.parse.quote(target)
+        return [
+            '<!DOCTYPE html>\n<html lang="zh-CN">\n<head>\n    <meta charset="UTF-8">\n',
+            f'    <title>{self.title}</title>\n    <link rel="canonical" href="{url}">\n',
+            f'    <meta http-equiv="refresh" content="0; url={url}">\n    <meta name="robots" content="noindex">\n',
+            f'</head>\n<body>\n    <a href="{url}">{target}</a>\n</body>\n</html>\n',
+        ]
+    
+    def get_album_search_data(self, album, media_pages):
+        """
+        相册的搜索数据，保存在构建清单中，相册未变化时直接沿用：
+        docs 为 [页面, 文件名, 日期, 缩略图, 相机型号] 列表，tokens 为 {词: [文档序号]}，
+        album_tokens 为相册名中的词（匹配相册内所有文档）
+        """
+        docs = []
+        tokens = {}
+        for index, (media, media_page) in enumerate(zip(album['media'], media_pages)):
+            date = self.get_media_date(media).strftime('%Y-%m-%d')
+            camera = (media.get('meta') or {}).get('camera') if self.search_exif else None
+            if media['type'] == 'video':
+                thumbnail = self.get_video_poster(media)
+            else:
+                thumbnail = media['thumbnails'][0][2] if media.get('thumbnails') else media['url']
+            docs.append([media_page, media['name'], date, thumbnail, camera or ''])
+            
+            text = ' '.join(filter(None, (os.path.splitext(media['name'])[0], date, camera)))
+            for token in set(tokenize_search_text(text)):
+                tokens.setdefault(token, []).append(index)
+        
+        return {
+            'album': album['display_name'],
+            'url': self.get_album_page_name(album),
+            'docs': docs,
+            'tokens': tokens,
+            'album_tokens': sorted(set(tokenize_search_text(album['display_name']))),
+        }
+    
+    def write_search_index(self, entries):
+        """
+        根据各相册的搜索数据生成客户端搜索索引：
+        search/t-<键>.json 为按词前缀分片的倒排表 {词: {相册: [文档序号] 或 "*"}}，
+        search/d-<相册>.json 为相册的文档列表，search/index.json 记录分片和文档文件的地址（带内容哈希）
+        内容哈希与上次相同的文件不重写，只有变化相册涉及的分片会更新；返回 (输出文件列表, 重写的文件数)
+        """
+        files = {}
+        shards = {}
+        albums = {}
+        for name, data in sorted(entries.items()):
+            slug = self.get_album_slug({'name': name})
+            doc_file = f"search/d-{slug}.json"
+            files[doc_file] = {'album': data['album'], 'url': data['url'], 'docs': data['docs']}
+            albums[slug] = doc_file
+            for token, indexes in data['tokens'].items():
+                shards.setdefault(get_search_shard_key(token), {}).setdefault(token, {})[slug] = indexes
+            # 相册名中的词匹配相册内所有文档，不逐个列出
+            for token in data['album_tokens']:
+                shards.setdefault(get_search_shard_key(token), {}).setdefault(token, {})[slug] = '*'
+        
+        shard_files = {}
+        for key, postings in sorted(shards.items()):
+            shard_file = f"search/t-{key.encode('utf-8').hex()}.json"
+            files[shard_file] = postings
+            shard_files[key] = shard_file
+        
+        (self.output_dir / 'search').mkdir(parents=True, exist_ok=True)
+        previous = self.cache.previous.get('search', {})
+        written = 0
+        
+        def write(path, data):
+            nonlocal written
+            content = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+            content_hash = hashlib.sha256(content).hexdigest()[:10]
+            self.cache.search[path] = content_hash
+            dest_path = self.output_dir / path
+            if previous.get(path) != content_hash or not dest_path.exists():
+                dest_path.write_bytes(content)
+                written += 1
+            return content_hash
+        
+        hashes = {path: write(path, data) for path, data in files.items()}
+        write(SEARCH_INDEX_URL, {
+            'version': 1,
+            'shards': {key: f"{path}?v={hashes[path]}" for key, path in shard_files.items()},
+            'albums': {slug: f"{path}?v={hashes[path]}" for slug, path in albums.items()},
+        })
+        if written:
+            print(f"🔍 搜索索引: {len(files) + 1} 个文件，更新 {written} 个")
+        return sorted(files) + [SEARCH_INDEX_URL], written
+    
+    def write_redirects(self, redirects):
+        """
+        写入重定向表：_redirects（Netlify、Cloudflare Pages，301 永久重定向）和 redirects.json（供 nginx map 等自行转换）
+        返回生成的文件列表
+        """
+        if not redirects:
+            return []
+        
+        lines = ['# 由 build_gallery.py 生成：旧媒体页面地址 -> 固定地址']
+        for old, new in sorted(redirects.items()):
+            lines.append(f"/{urllib.parse.quote(old)} /{urllib.parse.quote(new)} 301")
+        with open(self.output_dir / '_redirects', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        with open(self.output_dir / 'redirects.json', 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(redirects.items())), f, ensure_ascii=False, indent=1)
+        print(f"↪️  已写入 {len(redirects)} 条旧地址重定向")
+        return ['_redirects', 'redirects.json']
+    
+    def iter_album_cards(self, albums):
+        """首页相册卡片片段"""
+        card_template = self.templates['card']
+        for album in albums:
+            # 确定缩略图：优先使用配置的封面
+            if album.get('cover'):
+                thumbnail_attrs = f'src="{album["cover"]}"'
+            elif album['thumbnail']:
+                # 如果相册的第一个文件是视频，使用视频封面或占位图
+                if album['thumbnail']['type'] == 'video':
+                    thumbnail_attrs = f'src="{self.get_video_poster(album["thumbnail"])}"'
+                else:
+                    thumbnail_attrs = self.get_image_attrs(album['thumbnail'])
+            else:
+                thumbnail_attrs = None
+            
+            if thumbnail_attrs:
+                thumbnail = f'<img {thumbnail_attrs} alt="{album["display_name"]}" loading="lazy" decoding="async">'
+            else:
+                thumbnail = '<div class="no-thumbnail">无预览图</div>'
+            
+            # 确定媒体类型显示
+            media_types = set(album.get('media_types') or (media['type'] for media in album['media']))
+            if 'video' in media_types and 'image' in media_types:
+                type_text = f"{album['count']} 个文件"
+            elif 'video' in media_types:
+                type_text = f"{album['count']} 个视频"
+            else:
+                type_text = f"{album['count']} 张图片"
+            
+            yield from card_template.render(
+                link=self.get_album_page_name(album),
+                # 配置的封面不是相册中的媒体，没有占位图
+                placeholder='' if album.get('cover') else self.get_placeholder_attrs(album['thumbnail']),
+                thumbnail=thumbnail,
+                title=album['display_name'],
+                subtitle=type_text,
+            )
+    
+    def iter_media_cards(self, album, media_pages, start=0, end=None):
+        """相册页面媒体卡片片段（只输出 start:end 范围内的媒体）"""
+        card_template = self.templates['card']
+        for media, media_link in zip(album['media'][start:end], media_pages[start:end]):
+            if media['type'] == 'video':
+                # 视频文件使用封面或占位图，不加载实际视频
+                thumbnail_attrs = f'src="{self.get_video_poster(media)}"'
+            else:
+                thumbnail_attrs = self.get_image_attrs(media)
+            
+            yield from card_template.render(
+                link=media_link,
+                placeholder=self.get_placeholder_attrs(media),
+                thumbnail=f'<img {thumbnail_attrs} alt="{media["name"]}" loading="lazy" decoding="async">',
+                title=media['name'],
+                subtitle=self.get_media_subtitle(media),
+            )
+    
+    def generate_index_html(self, albums):
+        """按片段生成首页HTML"""
+        return self.templates['page'].render(
+            page_title=self.title,
+            description=f"图片画廊 - {self.title}",
+            breadcrumb='<a href="index.html">首页</a> / <span>所有相册</span>',
+            head='',
+            main=self.templates['grid'].render(
+                header='',
+                container_id='albums-container',
+                cards=self.iter_album_cards(albums),
+                pagination=CLIENT_PAGINATION_HTML,
+            ),
+            scripts='',
+        )
+    
+    def generate_album_html(self, album, media_pages=None, page=1, album_pages=None):
+        """按片段生成相册页面HTML；启用 page-size 时只生成第 page 页"""
+        if media_pages is None:
+            media_pages = self.get_media_page_names(album)
+        if album_pages is None:
+            album_pages = self.get_album_pages(album)
+        _, _, start, end = album_pages[page - 1]
+        
+        head = ''
+        page_title = f"{album['display_name']} - {self.title}"
+        if len(album_pages) > 1:
+            pagination = self.render_server_pagination(album, page, album_pages)
+            page_title = f"{album['display_name']} ({page}/{len(album_pages)}) - {self.title}"
+            if page > 1:
+                head += f'\n    <link rel="prev" href="{self.get_album_page_name(album, page - 1)}">'
+            if page < len(album_pages):
+                head += f'\n    <link rel="next" href="{self.get_album_page_name(album, page + 1)}">'
+        else:
+            pagination = CLIENT_PAGINATION_HTML
+        
+        header = f'<div class="album-header">\n            <h2>{album["display_name"]}</h2>\n        </div>\n\n        '
+        if self.album_render == 'virtual':
+            main = self.templates['virtual_grid'].render(
+                header=header,
+                manifest=self.get_album_manifest_name(album),
+                count=str(len(album['media'])),
+            )
+        else:
+            main = self.templates['grid'].render(
+                header=header,
+                container_id='media-container',
+                cards=self.iter_media_cards(album, media_pages, start, end),
+                pagination=pagination,
+            )
+        
+        return self.templates['page'].render(
+            page_title=page_title,
+            description=f"相册 - {album['display_name']}",
+            head=head,
+            breadcrumb=f'<a href="index.html">首页</a> / <span>{album["display_name"]}</span>',
+            main=main,
+            scripts='',
+        )
+    
+    def generate_media_html(self, album, media, album_page=None):
+        """按片段生成媒体查看页面HTML；album_page 为包含该媒体的相册分页"""
+        size_attrs = f' width="{media["width"]}" height="{media["height"]}"' if media.get('width') else ''
+        if media['type'] == 'video':
+            # 视频路径已经在上面的copy_media_files中编码过了，直接使用
+            mime_type = VIDEO_MIME_TYPES.get(media['path'].suffix.lower(), 'video/mp4')
+            poster = (media.get('video') or {}).get('poster')
+            content = self.templates['video'].render(
+                url=media['url'], mime_type=mime_type, poster=f' poster="{poster}"' if poster else '')
+        elif media.get('transcoded'):
+            # 现代格式优先，浏览器不支持时回退到原图
+            album_path = urllib.parse.quote(self.get_media_location(album, media)[0])
+            sources = ''.join(
+                f'\n                    <source type="{TRANSCODE_FORMATS[name][2]}" '
+                f'srcset="optimized/{album_path}/{urllib.parse.quote(filename, safe="")}">'
+                for name, filename in media['transcoded']
+            )
+            content = (
+                f'                <picture>{sources}\n'
+                f'                    <img src="{media["url"]}" alt="{media["name"]}"{size_attrs} loading="eager" decoding="sync">\n'
+                f'                </picture>'
+            )
+        else:
+            content = f'                <img src="{media["url"]}" alt="{media["name"]}"{size_attrs} loading="eager" decoding="sync">'
+        
+        return self.templates['page'].render(
+            page_title=f"{media['name']} - {album['display_name']} - {self.title}",
+            description=f"媒体文件 - {media['name']}",
+            head='',
+            breadcrumb=(
+                f'<a href="index.html">首页</a> / <a href="{album_page or self.get_album_page_name(album)}">'
+                f'{album["display_name"]}</a> / <span>{media["name"]}</span>'
+            ),
+            main=self.templates['media'].render(
+                content=content,
+                name=media['name'],
+                date=self.get_media_date(media).strftime('%Y-%m-%d %H:%M'),
+                size=str(media['size'] // 1024),
+            ),
+            scripts=self.templates['media_script'].render(url=media['url'], type=media['type']),
+        )
+    
+    def fingerprint_name(self, name, content):
+        """启用 fingerprint-assets 时在文件名中加入内容哈希（style.css -> style.1a2b3c4d5e.css）"""
+        if not self.fingerprint_assets:
+            return name
+        stem, extension = os.path.splitext(name)
+        return f"{stem}.{hashlib.sha256(content).hexdigest()[:10]}{extension}"
+    
+    def prepare_theme_assets(self):
+        """
+        读取需要发布的主题文件，返回 {源文件名: (输出路径, 内容)}
+        启用 fingerprint-assets 时字体、样式、脚本和配置文件的输出路径包含内容哈希，
+        style.css 中的字体引用同时改为带哈希的文件名
+        """
+        assets = {}
+        subset_fonts = self.get_subset_fonts()
+        
+        # 字体文件（需要裁剪的字体由 subset_fonts 单独生成）
+        fonts_src = Path('assets/fonts')
+        if fonts_src.exists():
+            for font_file in sorted(fonts_src.iterdir()):
+                if font_file.is_file() and f"assets/fonts/{font_file.name}" not in subset_fonts:
+                    content = font_file.read_bytes()
+                    assets[f"assets/fonts/{font_file.name}"] = (
+                        f"assets/fonts/{self.fingerprint_name(font_file.name, content)}", content)
+        
+        # CSS文件，字体引用改为输出路径
+        css_src = Path('themes/simple/style.css')
+        css = css_src.read_text(encoding='utf-8') if css_src.exists() else ''
+        for name, output in subset_fonts.items():
+            css = re.sub(r"url\(['\"]?" + re.escape(name) + r"['\"]?\)(\s*format\([^)]*\))?",
+                         f"url('{output}') format('woff2')", css)
+        for name, (output, _) in list(assets.items()):
+            css = css.replace(name, output)
+        content = css.encode('utf-8')
+        assets['style.css'] = (self.fingerprint_name('style.css', content), content)
+        
+        # JS文件和配置文件
+        for name, src in (('enhancements.js', Path('themes/simple/enhancements.js')), ('config.json', self.config_path)):
+            content = src.read_bytes() if src.exists() else b''
+            assets[name] = (self.fingerprint_name(name, content), content)
+        
+        # 视频占位图的地址写在清单和页面中，保持固定文件名
+        placeholder_src = Path('themes/simple/video-placeholder.svg')
+        if placeholder_src.exists():
+            assets[VIDEO_PLACEHOLDER_URL] = (VIDEO_PLACEHOLDER_URL, placeholder_src.read_bytes())
+        return assets
+    
+    def get_subset_fonts(self):
+        """
+        需要裁剪的字体 {源文件路径: 输出路径}：style.css 的 @font-face 中声明、
+        并且被 title-font、footer-font 或 global-font 使用的字体
+        裁剪结果的文件名固定（如 brand.woff2），使样式表和页面不随字符集变化
+        """
+        css_src = Path('themes/simple/style.css')
+        if not self.font_subset or not css_src.exists():
+            return {}
+        
+        families = {
+            family.strip().strip('\'"').lower()
+            for value in (self.title_font, self.footer_font, self.global_font)
+            for family in self.resolve_font(value).split(',')
+        }
+        fonts = {}
+        for block in re.findall(r'@font-face\s*\{([^}]*)\}', css_src.read_text(encoding='utf-8')):
+            family = re.search(r"font-family:\s*['\"]?([^;'\"]+)", block)
+            url = re.search(r"url\(['\"]?([^'\")]+)['\"]?\)", block)
+            if not family or not url or family.group(1).strip().lower() not in families:
+                continue
+            name = url.group(1)
+            if name.startswith('assets/fonts/') and Path(name).is_file():
+                fonts[name] = f"{os.path.splitext(name)[0]}.woff2"
+        return fonts
+    
+    def subset_fonts(self, page_glyphs):
+        """
+        按页面中实际出现的字符裁剪字体，结果按 字体内容 + 字符集 的哈希缓存，未变化时不重新裁剪
+        字符集包括可打印 ASCII、page_glyphs（首页，合并分片时还包括各分片相册页面的字符）、
+        各相册页面中的字符（未变化的相册沿用构建清单中记录的字符）以及 enhancements.js 中的界面文字
+        返回 (输出路径列表, 实际裁剪的字体数)
+        """
+        glyphs = {chr(code) for code in range(0x20, 0x7f)} | page_glyphs
+        for entry in self.cache.albums.values():
+            glyphs.update(entry.get('glyphs', ''))
+        js_src = Path('themes/simple/enhancements.js')
+        if js_src.exists():
+            glyphs.update(js_src.read_text(encoding='utf-8'))
+        text = ''.join(sorted(char for char in glyphs if char.isprintable()))
+        
+        outputs = []
+        subset_tasks = []
+        previous = self.cache.previous.get('fonts', {})
+        for name, output in self.get_subset_fonts().items():
+            key = hashlib.sha256(f"{hash_file(name)}\0{text}".encode('utf-8')).hexdigest()
+            outputs.append(output)
+            if previous.get(output) == key and (self.output_dir / output).exists():
+                self.cache.fonts[output] = key
+                continue
+            subset_tasks.append((name, output, key))
+        
+        if not subset_tasks:
+            return outputs, 0
         
-        if media['type'] == 'video':
-            # 视频路径已经在上面的copy_media_files中编码过了，直接使用
-            encoded_url = media['url']
-            # 根据文件扩展名确定MIME类型
-            ext = media['path'].suffix.lower()
-            if ext == '.mp4':
-                mime_type = 'video/mp4'
-            elif ext == '.webm':
-                mime_type = 'video/webm'
-            elif ext == '.ogg':
-                mime_type = 'video/ogg'
-            elif ext == '.avi':
-                mime_type = 'video/x-msvideo'
-            elif ext == '.mov':
-                mime_type = 'video/quicktime'
-            else:
-                mime_type = 'video/mp4'  # 默认
-            
-            html += f"""
-                <video controls preload="metadata" style="width: 100%; max-width: 800px; height: auto;" onerror="console.error('视频加载失败:', this.error); this.style.display='none'; this.nextElementSibling.style.display='block';">
-                    <source src="{encoded_url}" type="{mime_type}">
-                    您的浏览器不支持视频播放。
-                </video>
-                <div style="display: none; padding: 20px; text-align: center; background: #f5f5f5; border-radius: 8px;">
-                    <p>视频加载失败</p>
-                    <p>文件路径: {media['url']}</p>
-                    <p>编码路径: {encoded_url}</p>
-                    <p>MIME类型: {mime_type}</p>
-                    <a href="{encoded_url}" download>点击下载视频文件</a>
-                </div>
+        print(f"🔤 开始裁剪 {len(subset_tasks)} 个字体（{len(text)} 个字符）...")
+        (self.output_dir / 'assets' / 'fonts').mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=len(subset_tasks)) as executor:
+            futures = {
+                executor.submit(subset_font, name, str(self.output_dir / output), text): (name, output, key)
+                for name, output, key in subset_tasks
+            }
+            for future in as_completed(futures):
+                name, output, key = futures[future]
+                try:
+                    size = future.result()
+                    self.cache.fonts[output] = key
+                    print(f"   {name}: {os.path.getsize(name) / 1024:.1f}KB -> {output}: {size / 1024:.1f}KB")
+                except Exception as e:
+                    # 样式表和页面已经引用了 output，改为发布未裁剪的完整字体；不记录缓存，下次构建重新裁剪
+                    size = convert_font(name, self.output_dir / output)
+                    print(f"   错误: {name}: {e}，改用未裁剪的字体 -> {output}: {size / 1024:.1f}KB")
+        return outputs, len(subset_tasks)
+    
+    def copy_theme_files(self):
+        """发布主题文件（样式、脚本、字体、视频占位图和配置文件），返回输出路径列表"""
+        if self.theme_assets is None:
+            self.theme_assets = self.prepare_theme_assets()
+        
+        outputs = []
+        for name, (output, content) in self.theme_assets.items():
+            dest_path = self.output_dir / output
+            # 带哈希的文件内容不会变化，已存在时无需重写
+            if output == name or not dest_path.exists():
+                dest_path.parent.mkdir(parents=True, exist_ok=True)
+                dest_path.write_bytes(content)
+            outputs.append(output)
+        
+        if self.fingerprint_assets:
+            outputs.extend(self.write_cache_headers())
+        return outputs
+    
+    def write_cache_headers(self):
+        """
+        生成长期缓存的响应头配置：_headers（Netlify、Cloudflare Pages）和 nginx-cache.conf（在 server 块中 include）
+        带内容哈希的文件使用 immutable 缓存，返回生成的文件列表
+        """
+        immutable = 'public, max-age=31536000, immutable'
+        hashed_paths = sorted(
+            output for name, (output, _) in self.theme_assets.items() if output != name
+        )
+        
+        lines = ['# 由 build_gallery.py 生成：带内容哈希的文件永久缓存']
+        for path in hashed_paths + ['posters/*', 'optimized/*', 'media/*']:
+            lines += [f'/{path}', f'  Cache-Control: {immutable}']
+        with open(self.output_dir / '_headers', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        
+        nginx = f"""# 由 build_gallery.py 生成：在 server 块中 include 此文件
+# 带内容哈希的主题文件、视频封面、转码图片和合并发布的重复文件永久缓存，页面每次重新验证
+location ~* "\\.[0-9a-f]{{10}}\\.(css|js|json|ttf|otf|woff2?)$" {{
+    add_header Cache-Control "{immutable}";
+}}
+location ~ "^/(posters|optimized|media)/" {{
+    add_header Cache-Control "{immutable}";
+}}
+location ~* "\\.html$" {{
+    add_header Cache-Control "no-cache";
+}}
 """
+        with open(self.output_dir / 'nginx-cache.conf', 'w', encoding='utf-8') as f:
+            f.write(nginx)
+        return ['_headers', 'nginx-cache.conf']
+    
+    def iter_output_files(self, extensions):
+        """遍历输出目录中指定扩展名的文件（跳过隐藏文件），产出 os.DirEntry"""
+        pending = [self.output_dir]
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        yield entry
+    
+    def precompress_outputs(self, paths=None):
+        """
+        并行为输出目录中的文本文件生成 .gz/.br 预压缩副本，内容哈希未变化的文件跳过，返回检查的文件数
+        paths 为输出路径列表时只处理这些文件（分片构建时只压缩本分片生成的文件）
+        """
+        formats = ['.gz']
+        if brotli is not None:
+            formats.append('.br')
         else:
-            html += f'                <img src="{media["url"]}" alt="{media["name"]}" loading="eager" decoding="sync">'
+            print("⚠️  警告: 未安装 brotli，只生成 .gz 预压缩文件")
         
-        html += f"""
-            </div>
-            
-            <div class="media-details">
-                <h2>{media['name']}</h2>
-                <p class="media-date">{media['modified'].strftime('%Y-%m-%d %H:%M')}</p>
-                <p class="media-size">文件大小: {media['size'] // 1024} KB</p>
-                
-                <div class="media-actions">
-                    <button id="copy-url-btn" class="copy-btn" onclick="copyMediaUrl()">
-                        <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                            <rect x="9" y="9" width="13" height="13" rx="2" ry="2"></rect>
-                            <path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"></path>
-                        </svg>
-                        复制链接
-                    </button>
-                    <span id="copy-status" class="copy-status"></span>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <div class="footer">
-        <p>© {self.get_copyright_year()} <a href="{self.footer_link}" target="_blank">{self.footer}</a> • Powered by <a href="https://gw124.com/" target="_blank">Wen</a></p>
-    </div>
-
-    <script>
-        // 媒体URL数据
-        const mediaUrl = "{media['url']}";
-        const mediaType = "{media['type']}";
+        previous = self.cache.previous.get('compressed', {})
         
-        // 复制媒体URL函数
-        function copyMediaUrl() {{
-            const fullUrl = window.location.origin + '/' + mediaUrl;
-            
-            if (navigator.clipboard && window.isSecureContext) {{
-                // 使用现代 Clipboard API
-                navigator.clipboard.writeText(fullUrl).then(function() {{
-                    showCopyStatus('✅ 链接已复制到剪贴板！', 'success');
-                }}).catch(function(err) {{
-                    console.error('复制失败:', err);
-                    fallbackCopy(fullUrl);
-                }});
-            }} else {{
-                // 回退方案
-                fallbackCopy(fullUrl);
-            }}
-        }}
+        def sidecars_exist(path):
+            return all(os.path.exists(path + suffix) for suffix in formats)
         
-        // 回退复制方案
-        function fallbackCopy(text) {{
-            const textArea = document.createElement('textarea');
-            textArea.value = text;
-            textArea.style.position = 'fixed';
-            textArea.style.left = '-999999px';
-            textArea.style.top = '-999999px';
-            document.body.appendChild(textArea);
-            textArea.focus();
-            textArea.select();
-            
-            try {{
-                const successful = document.execCommand('copy');
-                if (successful) {{
-                    showCopyStatus('✅ 链接已复制到剪贴板！', 'success');
-                }} else {{
-                    showCopyStatus('❌ 复制失败，请手动复制', 'error');
-                }}
-            }} catch (err) {{
-                console.error('复制失败:', err);
-                showCopyStatus('❌ 复制失败，请手动复制', 'error');
-            }}
+        def compress_single(rel_path, path, stat):
+            """压缩单个文件，返回 (清单记录, 是否重新压缩)"""
+            with open(path, 'rb') as f:
+                data = f.read()
+            entry = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'hash': hashlib.sha256(data).hexdigest(),
+            }
+            old = previous.get(rel_path)
+            if old and old['hash'] == entry['hash'] and sidecars_exist(path):
+                return entry, False
             
-            document.body.removeChild(textArea);
-        }}
+            # mtime=0 使相同内容的 .gz 输出完全一致
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=self.gzip_level, mtime=0))
+            if '.br' in formats:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=self.brotli_quality))
+            return entry, True
         
-        // 显示复制状态
-        function showCopyStatus(message, type) {{
-            const statusElement = document.getElementById('copy-status');
-            statusElement.textContent = message;
-            statusElement.className = `copy-status ${{type}}`;
-            
-            // 3秒后清除状态
-            setTimeout(() => {{
-                statusElement.textContent = '';
-                statusElement.className = 'copy-status';
-            }}, 3000);
-        }}
-    </script>
-    
-    <script src="enhancements.js"></script>
-</body>
-</html>"""
+        if paths is None:
+            candidates = (
+                (Path(file_entry.path).relative_to(self.output_dir).as_posix(), file_entry.path, file_entry.stat())
+                for file_entry in self.iter_output_files(PRECOMPRESS_EXTENSIONS)
+            )
+        else:
+            candidates = (
+                (rel_path, str(self.output_dir / rel_path), os.stat(self.output_dir / rel_path))
+                for rel_path in paths
+                if os.path.splitext(rel_path)[1].lower() in PRECOMPRESS_EXTENSIONS and (self.output_dir / rel_path).is_file()
+            )
+        
+        compress_tasks = []
+        for rel_path, path, stat in candidates:
+            old = previous.get(rel_path)
+            if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime_ns and sidecars_exist(path):
+                # 大小和修改时间都未变化，无需读取内容
+                self.cache.compressed[rel_path] = old
+                continue
+            compress_tasks.append((rel_path, path, stat))
+        
+        if not compress_tasks:
+            return 0
+        
+        print(f"🗜️  开始并行检查 {len(compress_tasks)} 个文本文件的预压缩副本...")
+        start_time = time.time()
+        compressed = 0
         
-        return html
+        # zlib 和 brotli 压缩时会释放 GIL，线程池即可利用多核
+        with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(compress_tasks))) as executor:
+            futures = {executor.submit(compress_single, *task): task[0] for task in compress_tasks}
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    entry, changed = future.result()
+                    self.cache.compressed[rel_path] = entry
+                    compressed += changed
+                except Exception as e:
+                    print(f"   错误: {rel_path}: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 预压缩完成，重新压缩 {compressed} 个文件，耗时: {elapsed:.2f}秒")
+        return len(compress_tasks)
     
-    def copy_theme_files(self):
-        """复制主题文件到输出目录"""
-        # 复制CSS文件
-        css_src = Path('themes/simple/style.css')
-        if css_src.exists():
-            shutil.copy2(css_src, self.output_dir / 'style.css')
+    def get_build_signature(self):
+        """计算影响所有页面的全局签名（配置、构建脚本、主题文件和派生设置）"""
+        digest = hashlib.sha256()
+        # 派生设置包含运行环境决定的部分（如是否安装了 ffmpeg）
+        digest.update(json.dumps(self.get_derive_settings()).encode('utf-8'))
+        # 页面引用的主题文件名（启用资源指纹时包含字体等文件的内容哈希）
+        digest.update(json.dumps([output for output, _ in self.prepare_theme_assets().values()]).encode('utf-8'))
+        for path in [self.config_path, Path(__file__),
+                     Path('themes/simple/style.css'), Path('themes/simple/enhancements.js')]:
+            if path.exists():
+                digest.update(path.read_bytes())
+        return digest.hexdigest()
+    
+    def get_album_digest(self, album):
+        """计算相册内容摘要，相册页面只在摘要变化时重新生成"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([album['display_name'], album.get('cover')], ensure_ascii=False).encode('utf-8'))
+        for media in album['media']:
+            location = '/'.join(self.get_media_location(album, media))
+            digest.update(f"{media['name']}\0{media['size']}\0{media['mtime']}\0{location}\n".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get_derive_settings(self):
+        """影响各类派生文件的配置，配置变化时对应的缓存数据失效"""
+        return {
+            'publish': self.configured_publish,
+            'thumbnails': [self.thumbnail_widths, self.thumbnail_quality],
+            'transcoded': [self.transcode_formats, self.transcode_quality],
+            'placeholder': [self.image_placeholders, self.image_placeholder_size],
+            'video': [self.poster_extractor.name, self.video_poster_width],
+        }
+    
+    def apply_build_cache(self, albums, dirty=None):
+        """
+        根据构建清单标记未变化的媒体文件，并恢复缓存的派生数据
+        dirty 为变化相册集合时，其余相册视为未变化，不再逐个检查输出文件
+        """
+        self.cache.settings = self.get_derive_settings()
+        previous_settings = self.cache.previous.get('settings', {})
+        stale_fields = {field for field, value in self.cache.settings.items() if previous_settings.get(field) != value}
         
-        # 复制JS文件
-        js_src = Path('themes/simple/enhancements.js')
-        if js_src.exists():
-            shutil.copy2(js_src, self.output_dir / 'enhancements.js')
+        unchanged = 0
+        for album in albums:
+            verify = dirty is None or album['name'] in dirty
+            album['dirty'] = verify
+            for media in album['media']:
+                entry = self.cache.lookup(f"{album['name']}/{media['name']}", media, verify_outputs=verify)
+                media['cached'] = entry is not None
+                if entry:
+                    unchanged += 1
+                    for field in BuildCache.MEDIA_FIELDS:
+                        if field in entry and field not in stale_fields:
+                            media.setdefault(field, entry[field])
+        return unchanged
+    
+    def take_snapshot(self):
+        """
+        使用 os.scandir 遍历输入目录，为每个相册（含启用 nested-albums 时的子相册）计算快照摘要
+        每个文件只调用一次 stat（DirEntry 会缓存 stat 结果），并剪除排除目录
+        """
+        snapshot = {}
+        pending = [(self.input_dir, None)]
+        while pending:
+            path, name = pending.pop()
+            files = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if name is None and not self.in_shard(entry.name):
+                            continue
+                        if (name is None or self.nested_albums) and not self.is_excluded_dir(entry):
+                            pending.append((entry.path, entry.name if name is None else f"{name}/{entry.name}"))
+                    elif name is not None and entry.is_file() and self.get_media_type(entry.name) != 'unknown':
+                        stat = entry.stat()
+                        files.append(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}")
+            
+            if files:
+                files.sort()
+                snapshot[name] = hashlib.sha256('\n'.join(files).encode('utf-8')).hexdigest()
+        return snapshot
+    
+    def detect_changes(self):
+        """
+        与上次构建保存的快照比较，返回变化信息：
+        {'full': 是否需要重新生成所有页面, 'dirty': 新增/修改/删除的相册名集合, 'snapshot': 当前快照}
+        """
+        cache = BuildCache(self.output_dir, use_hash=self.cache_hash, filename=self.cache_filename)
+        snapshot = self.take_snapshot()
+        previous = cache.previous.get('snapshot', {})
         
-        # 复制字体文件
-        fonts_src = Path('assets/fonts')
-        if fonts_src.exists():
-            fonts_dest = self.output_dir / 'assets' / 'fonts'
-            fonts_dest.mkdir(parents=True, exist_ok=True)
-            for font_file in fonts_src.iterdir():
-                if font_file.is_file():
-                    shutil.copy2(font_file, fonts_dest / font_file.name)
+        dirty = {name for name, digest in snapshot.items() if previous.get(name) != digest}
+        dirty.update(name for name in previous if name not in snapshot)
         
-        # 复制配置文件
-        config_src = Path('config.json')
-        if config_src.exists():
-            shutil.copy2(config_src, self.output_dir / 'config.json')
+        full = not cache.loaded or cache.previous['signature'] != self.get_build_signature()
+        self.cache = cache
+        self.changes = {'full': full, 'dirty': dirty, 'snapshot': snapshot}
+        return self.changes
     
     def should_rebuild(self):
         """检查是否需要重新构建"""
         if not self.output_dir.exists():
             return True
         
-        # 检查配置文件是否更新
-        config_mtime = Path('config.json').stat().st_mtime
-        build_mtime = (self.output_dir / 'config.json').stat().st_mtime if (self.output_dir / 'config.json').exists() else 0
-        
-        if config_mtime > build_mtime:
+        changes = self.detect_changes()
+        if changes['full']:
+            return True
+        if self.shard is not None and not self.get_shard_summary_path().exists():
+            return True
+        if changes['dirty']:
+            print(f"🔍 检测到 {len(changes['dirty'])} 个相册有变化: {', '.join(sorted(changes['dirty']))}")
             return True
+        # 上次裁剪失败的字体发布的是完整字体，需要重新裁剪
+        if (self.shard is None and self.font_subset
+                and set(self.get_subset_fonts().values()) - set(self.cache.previous.get('fonts', {}))):
+            print("🔍 检测到上次未完成的字体裁剪")
+            return True
+        return False
+
+    def render_album_pages(self, album):
+        """生成单个相册的所有页面，返回 (结果说明, 写入的文件数)"""
+        start_time = time.perf_counter()
+        album_pages = self.get_album_pages(album)
+        media_pages = self.get_media_page_names(album)
         
-        # 检查主题文件是否更新
-        theme_files = [
-            ('themes/simple/style.css', 'style.css'),
-            ('themes/simple/enhancements.js', 'enhancements.js'),
-            ('build_gallery.py', None)  # 检查构建脚本本身
-        ]
+        page_names = [page_name for _, page_name, _, _ in album_pages] + media_pages
+        if self.album_render == 'virtual':
+            page_names.append(self.get_album_manifest_name(album))
+        redirects = self.get_legacy_redirects(album, media_pages)
+        if self.redirect_pages:
+            page_names.extend(redirects)
+        
+        # 相册内容和全局签名都未变化时沿用上次生成的页面
+        digest = self.get_album_digest(album)
+        previous = self.cache.previous['albums'].get(album['name'], {})
+        # 启用字体裁剪时，跳过的相册需要沿用上次记录的字符集
+        if (self.cache.album_unchanged(album['name'], digest, verify_outputs=album['dirty'])
+                and (not self.font_subset or 'glyphs' in previous)):
+            self.cache.record_album(album['name'], digest, page_names)
+            entry = self.cache.albums[album['name']]
+            entry['redirects'] = redirects
+            for field in ('glyphs', 'hashes', 'search'):
+                if field in previous:
+                    entry[field] = previous[field]
+            return f"相册 {album['name']}: 未变化，跳过", 0
+        
+        # 页面全部写入前只保留上次的页面记录且不记录摘要：中途出错时已有页面不会被当作孤立文件删除，
+        # 下次构建也会重新生成这个相册
+        self.cache.record_album(album['name'], None, previous.get('pages', []))
+        glyphs = set() if self.font_subset else None
+        
+        if self.album_render == 'virtual':
+            with open(self.output_dir / self.get_album_manifest_name(album), 'w', encoding='utf-8') as f:
+                json.dump(self.generate_album_manifest(album, media_pages), f,
+                          ensure_ascii=False, separators=(',', ':'))
+        
+        # 逐页比较内容哈希，只重写内容变化的页面：新增一个文件时其他媒体页面保持不变
+        previous_hashes = previous.get('hashes', {})
+        hashes = {}
+        written = 0
+        
+        def write(page_name, chunks):
+            nonlocal written
+            hashes[page_name], changed = self.write_page(
+                self.output_dir / page_name, chunks, glyphs, previous_hashes.get(page_name))
+            written += changed
+        
+        for page, album_page, start, end in album_pages:
+            # 写入相册页面
+            write(album_page, self.generate_album_html(album, media_pages, page, album_pages))
+            
+            # 生成媒体页面
+            for media, filename in zip(album['media'][start:end], media_pages[start:end]):
+                write(filename, self.generate_media_html(album, media, album_page))
+        
+        # 旧地址跳转页面
+        if self.redirect_pages:
+            for old, new in redirects.items():
+                write(old, self.generate_redirect_page(new))
         
-        for src_path, dest_name in theme_files:
-            src = Path(src_path)
-            if src.exists():
-                if dest_name:
-                    dest = self.output_dir / dest_name
-                    if not dest.exists() or dest.stat().st_mtime < src.stat().st_mtime:
-                        return True
+        self.cache.record_album(album['name'], digest, page_names)
+        entry = self.cache.albums[album['name']]
+        entry['redirects'] = redirects
+        entry['hashes'] = hashes
+        if self.search:
+            entry['search'] = self.get_album_search_data(album, media_pages)
+        
+        if glyphs is not None:
+            # 只记录非 ASCII 字符，ASCII 字符始终包含在裁剪的字体中
+            entry['glyphs'] = ''.join(sorted(char for char in glyphs if ord(char) > 0x7e))
+        self.profiler.record_album(album['name'], 'render', time.perf_counter() - start_time, written)
+        return (f"相册 {album['name']}: {len(album_pages)}个相册页面 + {len(media_pages)}个媒体页面，"
+                f"重写 {written} 个"), written
+    
+    def process_albums_phased(self, changes):
+        """
+        按阶段处理相册：每个阶段处理完所有相册后才进入下一阶段
+        返回 (排序后的相册列表, 与上次构建相同的媒体数)
+        """
+        print("📁 扫描画廊目录...")
+        with self.profiler.phase('scan') as phase:
+            if self.albums is not None and not changes['full']:
+                albums = self.rescan_albums(changes['dirty'])
+            else:
+                albums = self.scan_gallery()
+            total_media = sum(len(album['media']) for album in albums)
+            phase['files'] = total_media
+        if not albums:
+            return albums, 0
+        print(f"✅ 找到 {len(albums)} 个相册")
+        
+        unchanged = self.apply_build_cache(albums, None if changes['full'] else changes['dirty'])
+        
+        # 读取图片元数据（尺寸、拍摄时间），按配置排序
+        with self.profiler.phase('metadata') as phase:
+            phase['files'] = self.read_metadata(albums)
+        
+        # 检测重复文件，确定每个媒体的输出位置
+        duplicates = None
+        if self.dedupe:
+            print("♊ 检测重复文件...")
+            with self.profiler.phase('dedupe') as phase:
+                duplicates = self.find_duplicates(albums)
+                phase['files'] = total_media
+        self.assign_media_locations(albums, duplicates)
+        
+        # 复制媒体文件
+        print("📋 复制媒体文件...")
+        with self.profiler.phase('copy') as phase:
+            phase['files'] = self.copy_media_files(albums)
+        
+        # 生成缩略图
+        print("🖼️  生成缩略图...")
+        with self.profiler.phase('thumbnails') as phase:
+            phase['files'] = self.generate_thumbnails(albums)
+        
+        # 转码为现代图片格式
+        if self.transcode_formats:
+            print("🔄 转码图片...")
+            with self.profiler.phase('transcode') as phase:
+                phase['files'] = self.transcode_images(albums)
+        
+        # 生成卡片背景的模糊占位图
+        if self.image_placeholders:
+            print("🌫️  生成模糊占位图...")
+            with self.profiler.phase('placeholders') as phase:
+                phase['files'] = self.generate_placeholders(albums)
+        
+        # 提取视频封面
+        if not isinstance(self.poster_extractor, PlaceholderPosterExtractor):
+            print("🎬 提取视频封面...")
+            with self.profiler.phase('posters') as phase:
+                phase['files'] = self.extract_video_posters(albums)
+        
+        # 并行生成所有相册页面
+        print("🌐 生成HTML页面...")
+        start_time = time.time()
+        with self.profiler.phase('render') as phase:
+            with ThreadPoolExecutor(max_workers=min(4, len(albums))) as executor:
+                futures = [executor.submit(self.render_album_pages, album) for album in albums]
+                for future in as_completed(futures):
+                    try:
+                        result, written = future.result()
+                        phase['files'] += written
+                        print(f"  ✅ {result}")
+                    except Exception as e:
+                        print(f"  ❌ 生成页面时出错: {e}")
+        
+        elapsed = time.time() - start_time
+        print(f"✅ HTML页面生成完成，耗时: {elapsed:.2f}秒")
+        return albums, unchanged
+    
+    def run_pipeline(self, source, stages, queue_size):
+        """
+        用有界队列把各阶段连接成流水线：source 逐个产出相册，stages 为 [(阶段名, 处理函数, 线程数)]
+        相册完成一个阶段后立即进入下一阶段，下游队列满时上游阻塞，使同时在处理中的相册数有上限
+        处理函数返回处理的文件数；某个阶段出错的相册打印错误后跳过后续阶段，但仍保留在结果中（带 failed 标记）
+        返回处理完的相册列表（顺序不固定）
+        """
+        finished = object()
+        queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        remaining = [workers for _, _, workers in stages]
+        lock = threading.Lock()
+        results = []
+        errors = []
+        
+        def feed():
+            try:
+                for album in source:
+                    queues[0].put(album)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(stages[0][2]):
+                    queues[0].put(finished)
+        
+        def work(index):
+            name, func, _ = stages[index]
+            while True:
+                album = queues[index].get()
+                if album is finished:
+                    break
+                if not album.get('failed'):
+                    start_time = time.perf_counter()
+                    try:
+                        files = func(album)
+                        self.profiler.record_album(album['name'], name, time.perf_counter() - start_time, files)
+                    except Exception as e:
+                        album['failed'] = True
+                        print(f"  ❌ 相册 {album['name']} 在 {name} 阶段出错: {e}")
+                if index + 1 < len(stages):
+                    queues[index + 1].put(album)
                 else:
-                    # 对于build_gallery.py，只要它更新了就重新构建
-                    if build_mtime < src.stat().st_mtime:
-                        return True
-        
-        # 检查输入目录是否有新文件
-        for item in self.input_dir.rglob('*'):
-            if item.is_file():
-                input_mtime = item.stat().st_mtime
-                relative_path = item.relative_to(self.input_dir)
-                output_path = self.output_dir / relative_path
+                    results.append(album)
+            
+            # 本阶段最后一个线程退出时通知下一阶段结束
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and index + 1 < len(stages):
+                for _ in range(stages[index + 1][2]):
+                    queues[index + 1].put(finished)
+        
+        threads = [threading.Thread(target=feed, name='pipeline-source')]
+        for index, (name, _, workers) in enumerate(stages):
+            threads.extend(threading.Thread(target=work, args=(index,), name=f"pipeline-{name}") for _ in range(workers))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        if errors:
+            raise errors[0]
+        return results
+    
+    def process_albums_pipelined(self, changes):
+        """
+        按相册流水线处理：扫描完一个相册就开始发布它的媒体文件，发布完成后生成缩略图等派生文件，
+        派生文件就绪后立即写入该相册的页面；各阶段共用 I/O 线程池和图片处理进程池
+        返回 (排序后的相册列表, 与上次构建相同的媒体数)
+        """
+        dirty = None if changes['full'] else changes['dirty']
+        if self.albums is not None and dirty is not None:
+            # 监视模式：只重新扫描变化的相册
+            source = self.rescan_albums(dirty)
+        else:
+            source = self.iter_albums()
+        
+        print("🚰 流水线处理相册（扫描 → 发布媒体 → 缩略图/转码/封面 → 页面）...")
+        start_time = time.time()
+        lock = threading.Lock()
+        unchanged = 0
+        
+        def scan():
+            # 扫描在流水线的输入线程中进行，按取出每个相册的耗时计入 scan 步骤
+            albums = iter(source)
+            while True:
+                with self.profiler.stage('scan') as stage:
+                    album = next(albums, None)
+                    stage['files'] = len(album['media']) if album else 0
+                if album is None:
+                    return
+                yield album
+        
+        def publish(album):
+            nonlocal unchanged
+            count = self.apply_build_cache([album], dirty)
+            with lock:
+                unchanged += count
+            with self.profiler.stage('metadata') as metadata:
+                metadata['files'] = self.read_metadata([album], io_pool)
+            self.assign_media_locations([album])
+            with self.profiler.stage('copy') as copy:
+                copy['files'] = self.copy_media_files([album], io_pool)
+            return metadata['files'] + copy['files']
+        
+        def derive(album):
+            files = 0
+            for name, step, pool in (('thumbnails', self.generate_thumbnails, cpu_pool),
+                                     ('transcode', self.transcode_images, cpu_pool),
+                                     ('placeholders', self.generate_placeholders, cpu_pool),
+                                     ('posters', self.extract_video_posters, io_pool)):
+                with self.profiler.stage(name) as stage:
+                    stage['files'] = step([album], pool)
+                files += stage['files']
+            return files
+        
+        def render(album):
+            with self.profiler.stage('render') as stage:
+                result, stage['files'] = self.render_album_pages(album)
+            print(f"  ✅ {result}")
+            return stage['files']
+        
+        # 阶段在进程池关闭之后才结束，子进程已被回收，其CPU时间计入 child_cpu_seconds
+        # I/O 线程池同时用于读取元数据、复制小文件和等待 ffmpeg，按 scan-workers 和 copy-workers 中较大者确定线程数
+        with self.profiler.phase('pipeline') as phase:
+            with ThreadPoolExecutor(max_workers=max(self.scan_workers, self.copy_workers)) as io_pool, \
+                    ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as cpu_pool:
+                # 在启动流水线线程之前创建好子进程，避免在其他线程持有锁时 fork
+                cpu_pool.submit(os.getpid).result()
+                io_pool = self.profiler.wrap_executor(io_pool)
+                cpu_pool = self.profiler.wrap_executor(cpu_pool)
                 
-                if not output_path.exists() or output_path.stat().st_mtime < input_mtime:
-                    return True
+                # 每个阶段两个线程，一个相册的收尾阶段不会让共享的线程池和进程池空闲
+                albums = self.run_pipeline(
+                    scan(), [('publish', publish, 2), ('derive', derive, 2), ('render', render, 2)], self.pipeline_queue)
+            phase['files'] = sum(len(album['media']) for album in albums)
+            phase['stages'] = self.profiler.pop_stages()
         
-        return False
-
+        albums.sort(key=lambda x: x['sort_key'])
+        if albums:
+            print(f"✅ 流水线处理完成: {len(albums)} 个相册，耗时: {time.time() - start_time:.2f}秒")
+        return albums, unchanged
+    
+    def record_albums(self, albums):
+        """
+        把本次处理的媒体记入构建清单；某个步骤失败的媒体（或中途出错的相册中的所有媒体）沿用上次的记录，
+        同一相册中其余成功的媒体照常记录，并从快照中删除所在相册，下次构建会把它视为有变化并重新处理
+        """
+        for album in albums:
+            # 流水线中途出错的相册，后续阶段没有处理其中的任何媒体
+            aborted = album.pop('failed', False)
+            incomplete = aborted
+            for media in album['media']:
+                key = f"{album['name']}/{media['name']}"
+                failed = media.pop('failed', False)
+                if failed:
+                    incomplete = True
+                if failed or aborted:
+                    if key in self.cache.previous['sources']:
+                        self.cache.sources[key] = self.cache.previous['sources'][key]
+                else:
+                    self.cache.record_media(key, media)
+            
+            entry = self.cache.albums.get(album['name'])
+            if entry is None:
+                # 流水线中途出错、没有生成页面的相册保留上次的页面记录
+                previous = self.cache.previous['albums'].get(album['name'], {})
+                self.cache.record_album(album['name'], None, previous.get('pages', []))
+                incomplete = True
+            elif entry['digest'] is None:
+                incomplete = True
+            if incomplete:
+                self.cache.snapshot.pop(album['name'], None)
+    
+    def render_index(self, albums):
+        """生成首页，返回启用字体裁剪时首页中出现的字符集合"""
+        index_glyphs = set()
+        self.write_page(self.output_dir / 'index.html', self.generate_index_html(albums),
+                        index_glyphs if self.font_subset else None)
+        print("  ✅ 首页生成完成")
+        return index_glyphs
+    
+    def publish_theme(self, glyphs):
+        """复制主题文件并裁剪字体，输出记录到构建清单"""
+        print("🎨 复制主题文件...")
+        with self.profiler.phase('theme') as phase:
+            self.cache.assets = sorted(self.copy_theme_files())
+            phase['files'] = len(self.cache.assets)
+        
+        if self.font_subset:
+            print("🔤 裁剪字体...")
+            with self.profiler.phase('fonts') as phase:
+                outputs, phase['files'] = self.subset_fonts(glyphs)
+            self.cache.assets = sorted(self.cache.assets + outputs)
+    
+    def get_cache_outputs(self):
+        """本次构建清单登记的所有输出文件"""
+        outputs = set(self.cache.assets)
+        for entry in self.cache.sources.values():
+            outputs.update(entry['outputs'])
+        for entry in self.cache.albums.values():
+            outputs.update(entry['pages'])
+        return sorted(outputs)
+    
+    def get_shard_summary_path(self, shard=None):
+        index, count = shard or self.shard
+        return self.output_dir / f".gallery-shard-{index}-of-{count}.json"
+    
+    def get_album_summary(self, album):
+        """合并步骤生成首页相册卡片所需的相册信息"""
+        thumbnail = album['thumbnail']
+        return {
+            'name': album['name'],
+            'display_name': album['display_name'],
+            'sort_key': album['sort_key'],
+            'cover': album.get('cover'),
+            'count': album['count'],
+            'media_types': sorted(set(media['type'] for media in album['media'])),
+            'thumbnail': thumbnail and {
+                field: thumbnail.get(field)
+                for field in ('type', 'url', 'thumbnails', 'width', 'height', 'placeholder', 'video')
+            },
+            'glyphs': self.cache.albums.get(album['name'], {}).get('glyphs', ''),
+            'redirects': self.cache.albums.get(album['name'], {}).get('redirects', {}),
+            'search': self.cache.albums.get(album['name'], {}).get('search'),
+        }
+    
+    def write_shard_summary(self, albums):
+        """原子写入分片摘要，供 --merge 生成首页"""
+        index, count = self.shard
+        data = {
+            'version': BuildCache.VERSION,
+            'shard': index,
+            'shards': count,
+            'signature': self.cache.signature,
+            'albums': [self.get_album_summary(album) for album in albums],
+        }
+        path = self.get_shard_summary_path()
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        print(f"🧩 分片 {index}/{count}: {len(albums)} 个相册，摘要已写入 {path.name}")
+    
+    def load_shard_summaries(self):
+        """读取输出目录中的所有分片摘要，检查分片是否齐全且使用相同的配置构建"""
+        summaries = {}
+        for path in sorted(self.output_dir.glob('.gallery-shard-*-of-*.json')):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == BuildCache.VERSION:
+                summaries[(data['shard'], data['shards'])] = data
+        
+        counts = {count for _, count in summaries}
+        if not counts:
+            raise FileNotFoundError(f"输出目录中没有分片摘要: {self.output_dir}")
+        if len(counts) > 1:
+            raise ValueError(f"输出目录中混有不同分片数的摘要: {', '.join(map(str, sorted(counts)))}")
+        count = counts.pop()
+        missing = [str(index) for index in range(1, count + 1) if (index, count) not in summaries]
+        if missing:
+            raise ValueError(f"缺少分片 {', '.join(missing)}（共 {count} 个）")
+        if len({data['signature'] for data in summaries.values()}) > 1:
+            print("⚠️  警告: 各分片的构建签名不一致，可能使用了不同的配置或主题")
+        return [summaries[(index, count)] for index in range(1, count + 1)]
+    
+    def merge_shards(self):
+        """合并各分片的构建结果：生成首页、发布主题文件并裁剪字体"""
+        try:
+            print("🧩 合并分片构建结果...")
+            summaries = self.load_shard_summaries()
+            self.cache = BuildCache(self.output_dir, filename='.gallery-cache.merge.json')
+            self.cache.signature = self.get_build_signature()
+            
+            albums = []
+            glyphs = set()
+            redirects = {}
+            search_entries = {}
+            for summary in summaries:
+                for album in summary['albums']:
+                    glyphs.update(album.pop('glyphs'))
+                    redirects.update(album.pop('redirects', {}))
+                    search = album.pop('search', None)
+                    if search:
+                        search_entries[album['name']] = search
+                    album['media'] = []
+                    albums.append(album)
+            # JSON 中的排序键为列表，各分片的相册按同样的规则合并排序
+            albums.sort(key=lambda x: x['sort_key'])
+            
+            with self.profiler.phase('render') as phase:
+                self.compile_templates()
+                glyphs.update(self.render_index(albums))
+                phase['files'] = 1
+            self.publish_theme(glyphs)
+            self.cache.assets = sorted(self.cache.assets + self.write_redirects(redirects))
+            if self.search:
+                with self.profiler.phase('search') as phase:
+                    outputs, phase['files'] = self.write_search_index(search_entries)
+                self.cache.assets = sorted(self.cache.assets + outputs)
+            
+            with self.profiler.phase('cleanup') as phase:
+                phase['files'] = self.cache.remove_orphans()
+            
+            if self.precompress:
+                print("🗜️  生成预压缩文件...")
+                with self.profiler.phase('precompress') as phase:
+                    phase['files'] = self.precompress_outputs(['index.html'] + self.get_cache_outputs())
+            
+            self.cache.save()
+            self.profiler.totals.update(albums=len(albums), media=sum(album['count'] for album in albums))
+            print(f"🎉 合并完成！{len(summaries)} 个分片, {len(albums)} 个相册")
+            print(f"📂 输出目录: {self.output_dir}")
+        
+        except Exception as e:
+            print(f"❌ 合并失败: {e}")
+            raise
+    
     def build(self):
         """构建完整的画廊网站"""
         try:
             print("🚀 开始构建画廊...")
+            self.copy_engine.stats = {'files': 0, 'bytes': 0}
+            self.placeholder_index = None
             
             # 验证输入目录
             if not self.input_dir.exists():
                 raise FileNotFoundError(f"输入目录不存在: {self.input_dir}")
             
             # 检查是否需要重新构建
-            if not self.should_rebuild():
+            with self.profiler.phase('detect') as phase:
+                rebuild = self.should_rebuild()
+                phase['files'] = len((self.changes or {}).get('snapshot', ()))
+            if not rebuild:
                 print("✅ 检测到无需重新构建，跳过构建过程")
                 return
             
-            # 清理输出目录
-            if self.output_dir.exists():
-                shutil.rmtree(self.output_dir)
+            # 加载构建清单；旧版本输出没有清单，无法判断哪些文件过期，需要完整重建
+            # 分片构建时输出目录可能包含其他分片的结果，不能清空
+            changes = self.changes or self.detect_changes()
+            self.changes = None
+            self.legacy_pages = {}
+            if not self.cache.loaded and self.output_dir.exists():
+                # 清空之前记录旧版本发布的媒体页面，用于生成旧地址的重定向
+                self.legacy_pages = self.find_legacy_pages(changes['snapshot'])
+                if self.shard is None:
+                    shutil.rmtree(self.output_dir)
             self.output_dir.mkdir(parents=True, exist_ok=True)
+            self.cache.signature = self.get_build_signature()
+            self.cache.snapshot = changes['snapshot']
             
-            # 扫描画廊
-            print("📁 扫描画廊目录...")
-            albums = self.scan_gallery()
+            # 扫描并处理相册：复制媒体、生成派生文件和相册页面
+            self.compile_templates()
+            if self.build_mode == 'pipeline':
+                albums, unchanged = self.process_albums_pipelined(changes)
+            else:
+                albums, unchanged = self.process_albums_phased(changes)
+            self.albums = albums
+            total_media = sum(len(album['media']) for album in albums)
             if not albums:
                 print("⚠️  警告: 未找到任何相册")
+                if self.shard is not None:
+                    # 空分片也要写入摘要，合并时据此确认所有分片都已完成
+                    self.cache.save()
+                    self.write_shard_summary(albums)
                 return
-            print(f"✅ 找到 {len(albums)} 个相册")
-            
-            # 复制媒体文件
-            print("📋 复制媒体文件...")
-            self.copy_media_files(albums)
-            
-            # 生成HTML页面
-            print("🌐 生成HTML页面...")
-            start_time = time.time()
-            
-            # 生成首页
-            index_html = self.generate_index_html(albums)
-            with open(self.output_dir / 'index.html', 'w', encoding='utf-8') as f:
-                f.write(index_html)
-            print("  ✅ 首页生成完成")
-            
-            # 并行生成相册和媒体页面
-            def generate_album_pages(album):
-                """生成单个相册的所有页面"""
-                album_html = self.generate_album_html(album)
-                safe_album_name = album["name"].replace(' ', '_')
-                
-                # 写入相册页面
-                with open(self.output_dir / f'album_{safe_album_name}.html', 'w', encoding='utf-8') as f:
-                    f.write(album_html)
-                
-                # 生成媒体页面
-                media_pages = []
-                for i, media in enumerate(album['media']):
-                    media_html = self.generate_media_html(album, media)
-                    media_hash = hashlib.md5(media['name'].encode('utf-8')).hexdigest()[:8]
-                    filename = f'media_{album["name"]}_{i}_{media_hash}.html'
-                    
-                    with open(self.output_dir / filename, 'w', encoding='utf-8') as f:
-                        f.write(media_html)
-                    media_pages.append(filename)
-                
-                return f"相册 {album['name']}: 1个相册页面 + {len(media_pages)}个媒体页面"
             
-            # 并行生成所有相册页面
-            with ThreadPoolExecutor(max_workers=min(4, len(albums))) as executor:
-                futures = [executor.submit(generate_album_pages, album) for album in albums]
+            print(f"♻️  {unchanged}/{total_media} 个媒体文件与上次构建相同")
+            if self.copy_engine.stats['files']:
+                print(f"📋 共复制 {self.copy_engine.stats['files']} 个媒体文件，"
+                      f"{self.copy_engine.stats['bytes'] / 1024 / 1024:.1f}MB")
+            
+            # 生成首页；分片构建时首页由合并步骤生成
+            if self.shard is None:
+                with self.profiler.phase('index') as phase:
+                    index_glyphs = self.render_index(albums)
+                    phase['files'] = 1
+            
+            # 复制主题文件，裁剪字体，写入旧地址重定向表
+            if self.shard is None:
+                self.publish_theme(index_glyphs)
+                redirects = {}
+                for entry in self.cache.albums.values():
+                    redirects.update(entry.get('redirects', {}))
+                self.cache.assets = sorted(self.cache.assets + self.write_redirects(redirects))
                 
-                completed = 0
-                for future in as_completed(futures):
-                    try:
-                        result = future.result()
-                        completed += 1
-                        print(f"  ✅ {result}")
-                    except Exception as e:
-                        print(f"  ❌ 生成页面时出错: {e}")
+                # 更新搜索索引，只重写内容变化的分片
+                if self.search:
+                    with self.profiler.phase('search') as phase:
+                        outputs, phase['files'] = self.write_search_index({
+                            name: entry['search'] for name, entry in self.cache.albums.items() if 'search' in entry
+                        })
+                    self.cache.assets = sorted(self.cache.assets + outputs)
             
-            elapsed = time.time() - start_time
-            print(f"✅ HTML页面生成完成，耗时: {elapsed:.2f}秒")
+            # 更新构建清单并清理孤立文件
+            with self.profiler.phase('cleanup') as phase:
+                self.record_albums(albums)
+                removed = self.cache.remove_orphans()
+                phase['files'] = removed
+            if removed:
+                print(f"🧹 已删除 {removed} 个过期的输出文件")
             
-            # 复制主题文件
-            print("🎨 复制主题文件...")
-            self.copy_theme_files()
+            # 生成预压缩副本
+            if self.precompress:
+                print("🗜️  生成预压缩文件...")
+                with self.profiler.phase('precompress') as phase:
+                    phase['files'] = self.precompress_outputs(None if self.shard is None else self.get_cache_outputs())
+            
+            self.cache.save()
+            if self.shard is not None:
+                self.write_shard_summary(albums)
+            self.profiler.totals.update(albums=len(albums), media=total_media, unchanged_media=unchanged)
             
-            total_media = sum(len(album['media']) for album in albums)
             print(f"🎉 构建完成！")
             print(f"📊 统计: {len(albums)} 个相册, {total_media} 个媒体文件")
             print(f"📂 输出目录: {self.output_dir}")
@@ -781,6 +3635,194 @@ class GalleryBuilder:
             print(f"❌ 构建失败: {e}")
             raise
 
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """预览服务器的请求处理器，不输出每个请求的访问日志"""
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_output(output_dir, port, host='127.0.0.1'):
+    """在后台线程中启动本地预览服务器，返回服务器对象"""
+    handler = functools.partial(QuietRequestHandler, directory=str(output_dir))
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌍 预览地址: http://{host}:{server.server_address[1]}/")
+    return server
+
+
+class GalleryWatcher:
+    """
+    监视模式：保留同一个 GalleryBuilder 及其扫描结果，在输入目录、主题文件或配置变化后增量重新构建
+    安装 watchdog 时由 inotify 等系统通知触发检查，否则按间隔轮询目录快照；
+    只有变化的相册会被重新扫描和生成页面，配置文件变化时重新加载配置
+    """
+    
+    def __init__(self, builder, interval=0.5, debounce=0.2):
+        self.builder = builder
+        self.interval = interval
+        self.debounce = debounce
+        self.event = threading.Event()
+        self.observer = None
+    
+    def get_watched_files(self):
+        """配置文件、主题文件和字体文件的大小与修改时间"""
+        paths = [self.builder.config_path]
+        for directory in (Path('themes/simple'), Path('assets/fonts')):
+            if directory.is_dir():
+                paths.extend(sorted(path for path in directory.iterdir() if path.is_file()))
+        
+        state = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+                state[str(path)] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                state[str(path)] = None
+        return state
+    
+    def get_state(self):
+        return self.get_watched_files(), self.builder.take_snapshot()
+    
+    def start_observer(self):
+        """启动 watchdog 监视；未安装时返回 False，改为轮询"""
+        if Observer is None:
+            return False
+        
+        handler = FileSystemEventHandler()
+        handler.on_any_event = lambda event: self.event.set()
+        self.observer = Observer()
+        directories = {
+            os.path.realpath(self.builder.input_dir): True,
+            os.path.realpath('themes/simple'): False,
+            os.path.realpath(self.builder.config_path.parent): False,
+        }
+        for directory, recursive in directories.items():
+            if os.path.isdir(directory):
+                self.observer.schedule(handler, directory, recursive=recursive)
+        self.observer.start()
+        return True
+    
+    def wait_until_settled(self, state):
+        """等待文件写入完成（例如正在复制的大文件），连续两次检查结果相同后返回"""
+        while True:
+            time.sleep(self.debounce)
+            settled = self.get_state()
+            if settled == state:
+                return state
+            state = settled
+    
+    def rebuild(self, config_changed):
+        start_time = time.perf_counter()
+        try:
+            if config_changed:
+                print("⚙️  配置文件已变化，重新加载配置")
+                self.builder = GalleryBuilder(self.builder.config_path, profiler=self.builder.profiler)
+            self.builder.build()
+            print(f"⚡ 重新构建完成，耗时: {time.perf_counter() - start_time:.2f}秒")
+        except Exception as e:
+            # 构建失败时保持监视，修正后自动重试
+            print(f"❌ 重新构建失败: {e}")
+    
+    def run(self):
+        self.rebuild(config_changed=False)
+        state = self.get_state()
+        
+        if self.start_observer():
+            print("👀 正在监视文件变化（watchdog），按 Ctrl+C 退出")
+        else:
+            print(f"👀 正在监视文件变化（每 {self.interval} 秒轮询），按 Ctrl+C 退出")
+        
+        try:
+            while True:
+                # 使用 watchdog 时仍然定期检查一次，防止遗漏网络文件系统上的变化
+                self.event.wait(self.interval if self.observer is None else 5)
+                self.event.clear()
+                
+                current = self.get_state()
+                if current == state:
+                    continue
+                current = self.wait_until_settled(current)
+                config_changed = current[0].get(str(self.builder.config_path)) != state[0].get(str(self.builder.config_path))
+                state = current
+                print("🔄 检测到文件变化，重新构建...")
+                self.rebuild(config_changed)
+                # 构建期间发生的变化在下一轮比较中处理
+        except KeyboardInterrupt:
+            print("👋 已停止监视")
+        finally:
+            if self.observer is not None:
+                self.observer.stop()
+                self.observer.join()
+
+
+def parse_shard(value):
+    """解析 --shard 参数 i/N（i 从 1 开始）"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"格式应为 i/N，如 1/4: {value}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"分片序号应在 1 到 {count} 之间: {value}")
+    return index, count
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='静态图片画廊生成器')
+    parser.add_argument('--config', default='config.json', help='配置文件路径（默认: config.json）')
+    parser.add_argument('--profile', nargs='?', const='build-profile.json', metavar='PATH',
+                        help='记录各构建阶段的耗时、CPU时间和读写量，并写入 JSON 报告（默认: build-profile.json）')
+    parser.add_argument('--cprofile', metavar='PATH', help='同时使用 cProfile 记录函数级性能数据并写入 PATH')
+    parser.add_argument('--watch', action='store_true', help='监视输入目录、主题和配置文件，变化后增量重新构建')
+    parser.add_argument('--interval', type=float, default=0.5, help='监视模式的轮询间隔秒数（默认: 0.5）')
+    parser.add_argument('--serve', nargs='?', type=int, const=8000, metavar='PORT',
+                        help='构建后启动本地预览服务器（默认端口: 8000）')
+    shard_group = parser.add_mutually_exclusive_group()
+    shard_group.add_argument('--shard', type=parse_shard, metavar='i/N',
+                             help='分片构建：只处理第 i 个分片（共 N 个）的相册，不生成首页和主题文件')
+    shard_group.add_argument('--merge', action='store_true',
+                             help='合并输出目录中各分片的构建结果，生成首页并发布主题文件')
+    args = parser.parse_args(argv)
+    if (args.shard or args.merge) and (args.watch or args.serve is not None):
+        parser.error('--shard/--merge 不能与 --watch/--serve 同时使用')
+    
+    profiler = BuildProfiler(enabled=bool(args.profile or args.cprofile))
+    builder = GalleryBuilder(args.config, profiler=profiler, shard=args.shard)
+    run = builder.merge_shards if args.merge else builder.build
+    
+    if args.watch or args.serve is not None:
+        if args.serve is not None:
+            builder.output_dir.mkdir(parents=True, exist_ok=True)
+            serve_output(builder.output_dir, args.serve)
+        if args.watch:
+            GalleryWatcher(builder, interval=args.interval).run()
+        else:
+            builder.build()
+            try:
+                print("按 Ctrl+C 停止预览服务器")
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                print("👋 已停止预览服务器")
+        return
+    
+    if args.cprofile:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        try:
+            cprofiler.runcall(run)
+        finally:
+            cprofiler.dump_stats(args.cprofile)
+            print(f"📈 cProfile 数据已写入: {args.cprofile}")
+    else:
+        run()
+    
+    if args.profile:
+        profiler.print_summary()
+        profiler.write(args.profile)
+        print(f"📈 构建性能报告已写入: {args.profile}")
+
+
 if __name__ == "__main__":
-    builder = GalleryBuilder()
-    builder.build()
+    main()
@@ -6,6 +6,11 @@
 (function() {
     'use strict';
     
+    // 配置文件地址由页面中的 script 标签提供，启用资源指纹时文件名包含内容哈希，可以长期缓存
+    const configUrl = (document.currentScript && document.currentScript.dataset.config) || './config.json';
+    // 启用 search 时由构建脚本提供搜索索引地址
+    const searchUrl = document.currentScript && document.currentScript.dataset.search;
+    
     // 等待页面加载完成
     document.addEventListener('DOMContentLoaded', function() {
         initializeEnhancements();
@@ -13,6 +18,15 @@
     
     async function initializeEnhancements() {
         try {
+            // 卡片图片加载完成后移除模糊占位图
+            document.querySelectorAll('.album-thumbnail[data-placeholder]').forEach(watchPlaceholder);
+            
+            // 虚拟滚动相册不依赖配置，先开始加载清单
+            initializeVirtualGrid();
+            
+            // 搜索框，索引在第一次使用时才加载
+            initializeSearch();
+            
             // 应用配置
             await applyConfiguration();
             
@@ -25,10 +39,18 @@
     }
     
     async function applyConfiguration() {
+        // 构建时内联到页面中的配置，无需再请求 config.json
+        if (window.__GALLERY_CONFIG__) {
+            applyFontConfiguration(window.__GALLERY_CONFIG__);
+            applyFooterConfiguration(window.__GALLERY_CONFIG__);
+            return;
+        }
+        
         let config = {};
         
         try {
-            const response = await fetch('./config.json?' + Date.now());
+            // 文件名不带哈希时向服务器重新验证，而不是每次都绕过缓存重新下载
+            const response = await fetch(configUrl, { cache: /\.[0-9a-f]{10}\.json$/.test(configUrl) ? 'default' : 'no-cache' });
             if (response.ok) {
                 config = await response.json();
             }
@@ -159,6 +181,16 @@
     }
     
     function initializePagination() {
+        // 虚拟滚动相册不需要分页
+        if (document.querySelector('.virtual-grid')) return;
+        
+        // 构建时已按 page-size 生成静态分页，只做渐进增强
+        const serverPagination = document.querySelector('.pagination-container[data-server-pagination]');
+        if (serverPagination) {
+            initializeServerPagination();
+            return;
+        }
+        
         const albums = document.querySelectorAll('.album');
         if (albums.length === 0) return;
         
@@ -186,6 +218,388 @@
         pagination.init();
     }
     
+    function initializeServerPagination() {
+        const prevLink = document.querySelector('link[rel="prev"]');
+        const nextLink = document.querySelector('link[rel="next"]');
+        
+        // 空闲时预取下一页，翻页时几乎无需等待
+        if (nextLink) {
+            const prefetch = () => {
+                const link = document.createElement('link');
+                link.rel = 'prefetch';
+                link.href = nextLink.href;
+                document.head.appendChild(link);
+            };
+            if ('requestIdleCallback' in window) {
+                requestIdleCallback(prefetch);
+            } else {
+                setTimeout(prefetch, 1000);
+            }
+        }
+        
+        // 左右方向键翻页
+        document.addEventListener('keydown', (event) => {
+            if (event.target.closest('input, textarea, select, [contenteditable]')) return;
+            if (event.key === 'ArrowLeft' && prevLink) {
+                window.location.href = prevLink.href;
+            } else if (event.key === 'ArrowRight' && nextLink) {
+                window.location.href = nextLink.href;
+            }
+        });
+    }
+    
+    function initializeVirtualGrid() {
+        const container = document.querySelector('.virtual-grid[data-manifest]');
+        if (!container) return;
+        
+        fetch(container.dataset.manifest)
+            .then(response => {
+                if (!response.ok) throw new Error(response.status);
+                return response.json();
+            })
+            .then(manifest => new VirtualGrid(container, manifest).init())
+            .catch(error => {
+                console.error('无法加载相册清单:', error);
+                container.textContent = '相册加载失败，请刷新页面重试。';
+            });
+    }
+    
+    // 模糊占位图：图片加载期间隐藏图片并显示内联的背景，加载完成后淡入图片再移除背景
+    function watchPlaceholder(thumbnail) {
+        const img = thumbnail.querySelector('img');
+        if (!img) return;
+        const reveal = () => {
+            thumbnail.classList.remove('placeholder-loading');
+            // 等淡入结束后移除背景，透明图片下面不再透出占位图
+            setTimeout(() => {
+                thumbnail.style.backgroundImage = '';
+                delete thumbnail.dataset.placeholder;
+            }, 400);
+        };
+        if (img.complete) {
+            reveal();
+            return;
+        }
+        thumbnail.classList.add('placeholder-loading');
+        img.addEventListener('load', reveal, { once: true });
+        img.addEventListener('error', reveal, { once: true });
+    }
+    
+    function initializeSearch() {
+        const header = document.querySelector('.header');
+        if (!searchUrl || !header) return;
+        
+        const box = document.createElement('div');
+        box.className = 'search-box';
+        const input = document.createElement('input');
+        input.type = 'search';
+        input.placeholder = '搜索文件名、相册、日期…';
+        input.setAttribute('aria-label', '搜索');
+        const results = document.createElement('div');
+        results.className = 'search-results';
+        results.hidden = true;
+        box.append(input, results);
+        header.appendChild(box);
+        
+        const index = new SearchIndex(searchUrl);
+        let timer = null;
+        let latest = 0;
+        
+        // 获得焦点时预先加载索引清单，输入后只加载查询词所在的分片
+        input.addEventListener('focus', () => index.loadManifest().catch(() => {}), { once: true });
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(async () => {
+                const query = input.value;
+                const current = ++latest;
+                try {
+                    const found = await index.search(query);
+                    // 忽略过期查询的结果
+                    if (current === latest) renderSearchResults(results, query, found);
+                } catch (error) {
+                    console.error('搜索失败:', error);
+                }
+            }, 150);
+        });
+        input.addEventListener('keydown', (event) => {
+            if (event.key === 'Escape') {
+                input.value = '';
+                results.hidden = true;
+            }
+        });
+        document.addEventListener('click', (event) => {
+            if (!box.contains(event.target)) results.hidden = true;
+        });
+    }
+    
+    function renderSearchResults(container, query, found) {
+        container.replaceChildren();
+        if (!query.trim()) {
+            container.hidden = true;
+            return;
+        }
+        
+        const summary = document.createElement('div');
+        summary.className = 'search-summary';
+        if (found.items.length === 0) {
+            summary.textContent = '没有找到匹配的文件';
+        } else if (found.total > found.items.length) {
+            summary.textContent = `找到 ${found.total} 个结果，显示前 ${found.items.length} 个`;
+        } else {
+            summary.textContent = `找到 ${found.total} 个结果`;
+        }
+        container.appendChild(summary);
+        
+        found.items.forEach(item => {
+            const link = document.createElement('a');
+            link.className = 'search-result';
+            link.href = item.page;
+            const img = document.createElement('img');
+            img.src = item.thumbnail;
+            img.alt = '';
+            img.loading = 'lazy';
+            img.decoding = 'async';
+            const name = document.createElement('span');
+            name.className = 'search-result-name';
+            name.textContent = item.name;
+            const meta = document.createElement('span');
+            meta.className = 'search-result-meta';
+            meta.textContent = [item.album, item.date, item.camera].filter(Boolean).join(' · ');
+            link.append(img, name, meta);
+            container.appendChild(link);
+        });
+        container.hidden = false;
+    }
+    
+    // 分片搜索索引：清单、词分片和相册文档文件都按需加载并缓存，文件地址带内容哈希
+    class SearchIndex {
+        constructor(url) {
+            this.url = url;
+            this.base = new URL(url, document.baseURI);
+            this.manifest = null;
+            this.files = new Map();
+            this.limit = 50;
+            // 分词规则与构建脚本一致：中日韩文字逐字，其他文字按连续的字母数字
+            const cjk = '\\u3040-\\u30ff\\u3400-\\u4dbf\\u4e00-\\u9fff\\uf900-\\ufaff\\uac00-\\ud7af';
+            this.cjkPattern = new RegExp(`^[${cjk}]$`, 'u');
+            this.tokenPattern = new RegExp(`[${cjk}]|(?:(?![${cjk}])[\\p{L}\\p{N}])+`, 'gu');
+        }
+        
+        loadManifest() {
+            if (!this.manifest) {
+                // 清单地址固定，每次向服务器重新验证
+                this.manifest = fetch(this.url, { cache: 'no-cache' }).then(response => {
+                    if (!response.ok) throw new Error(response.status);
+                    return response.json();
+                });
+                this.manifest.catch(() => { this.manifest = null; });
+            }
+            return this.manifest;
+        }
+        
+        loadFile(path) {
+            // 索引中的路径相对于网站根目录
+            const url = new URL(path, new URL('..', this.base)).href;
+            if (!this.files.has(url)) {
+                this.files.set(url, fetch(url).then(response => {
+                    if (!response.ok) throw new Error(response.status);
+                    return response.json();
+                }));
+            }
+            return this.files.get(url);
+        }
+        
+        tokenize(text) {
+            return (text.toLowerCase().match(this.tokenPattern) || [])
+                .filter(token => Array.from(token).length > 1 || this.cjkPattern.test(token));
+        }
+        
+        async search(query) {
+            const tokens = [...new Set(this.tokenize(query))];
+            if (tokens.length === 0) return { total: 0, items: [] };
+            const manifest = await this.loadManifest();
+            
+            // 每个查询词按前缀匹配，结果为 {相册: Set(文档序号) 或 '*'}，多个词取交集
+            let matches = null;
+            for (const token of tokens) {
+                const shardPath = manifest.shards[Array.from(token).slice(0, 2).join('')];
+                const shard = shardPath ? await this.loadFile(shardPath) : {};
+                const tokenMatches = new Map();
+                for (const [word, postings] of Object.entries(shard)) {
+                    if (!word.startsWith(token)) continue;
+                    for (const [album, indexes] of Object.entries(postings)) {
+                        const existing = tokenMatches.get(album);
+                        if (indexes === '*' || existing === '*') {
+                            tokenMatches.set(album, '*');
+                        } else {
+                            const set = existing || new Set();
+                            indexes.forEach(index => set.add(index));
+                            tokenMatches.set(album, set);
+                        }
+                    }
+                }
+                matches = matches === null ? tokenMatches : this.intersect(matches, tokenMatches);
+                if (matches.size === 0) break;
+            }
+            
+            // 只加载需要显示的相册文档文件
+            const items = [];
+            let total = 0;
+            for (const [album, indexes] of matches) {
+                const docsPath = manifest.albums[album];
+                if (!docsPath) continue;
+                if (items.length >= this.limit && indexes !== '*') {
+                    total += indexes.size;
+                    continue;
+                }
+                const data = await this.loadFile(docsPath);
+                const selected = indexes === '*' ? data.docs.map((_, index) => index) : [...indexes].sort((a, b) => a - b);
+                total += selected.length;
+                for (const index of selected) {
+                    if (items.length >= this.limit) break;
+                    const [page, name, date, thumbnail, camera] = data.docs[index];
+                    items.push({ page, name, date, thumbnail, camera, album: data.album });
+                }
+            }
+            return { total, items };
+        }
+        
+        intersect(left, right) {
+            const result = new Map();
+            for (const [album, indexes] of left) {
+                const other = right.get(album);
+                if (!other) continue;
+                if (indexes === '*') {
+                    result.set(album, other);
+                } else if (other === '*') {
+                    result.set(album, indexes);
+                } else {
+                    const common = new Set([...indexes].filter(index => other.has(index)));
+                    if (common.size > 0) result.set(album, common);
+                }
+            }
+            return result;
+        }
+    }
+    
+    // 虚拟滚动网格：卡片按块渲染，只有接近视口的块才会生成 DOM
+    class VirtualGrid {
+        constructor(container, manifest) {
+            this.container = container;
+            this.manifest = manifest;
+            this.items = manifest.items || [];
+            this.blockSize = 24;
+            this.estimatedRowHeight = 364;
+        }
+        
+        init() {
+            this.blocks = [];
+            for (let start = 0; start < this.items.length; start += this.blockSize) {
+                const block = document.createElement('div');
+                block.className = 'albums virtual-block';
+                block.dataset.start = start;
+                block.dataset.end = Math.min(start + this.blockSize, this.items.length);
+                this.container.appendChild(block);
+                this.blocks.push(block);
+            }
+            
+            // 根据当前列数估算未渲染块的高度，保持滚动条稳定
+            const columns = this.getColumnCount();
+            this.blocks.forEach(block => {
+                const rows = Math.ceil((block.dataset.end - block.dataset.start) / columns);
+                block.style.minHeight = `${rows * this.estimatedRowHeight}px`;
+            });
+            
+            if (!('IntersectionObserver' in window)) {
+                this.blocks.forEach(block => this.renderBlock(block));
+                return;
+            }
+            
+            this.observer = new IntersectionObserver(entries => {
+                entries.forEach(entry => {
+                    if (entry.isIntersecting) {
+                        this.renderBlock(entry.target);
+                    } else {
+                        this.releaseBlock(entry.target);
+                    }
+                });
+            }, { rootMargin: '800px 0px' });
+            this.blocks.forEach(block => this.observer.observe(block));
+        }
+        
+        getColumnCount() {
+            if (!this.blocks.length) return 1;
+            const columns = getComputedStyle(this.blocks[0]).gridTemplateColumns.split(' ').filter(Boolean);
+            return Math.max(1, columns.length);
+        }
+        
+        renderBlock(block) {
+            if (block.dataset.rendered) return;
+            const fragment = document.createDocumentFragment();
+            for (let i = Number(block.dataset.start); i < Number(block.dataset.end); i++) {
+                fragment.appendChild(this.createCard(this.items[i]));
+            }
+            block.appendChild(fragment);
+            block.dataset.rendered = 'true';
+        }
+        
+        releaseBlock(block) {
+            if (!block.dataset.rendered) return;
+            // 记录实际高度后移除卡片，释放远离视口的 DOM 和图片
+            block.style.minHeight = `${block.offsetHeight}px`;
+            block.replaceChildren();
+            delete block.dataset.rendered;
+        }
+        
+        createCard(item) {
+            const card = document.createElement('div');
+            card.className = 'album';
+            
+            const link = document.createElement('a');
+            link.href = item.page;
+            
+            const thumbnail = document.createElement('div');
+            thumbnail.className = 'album-thumbnail';
+            const img = document.createElement('img');
+            img.alt = item.name;
+            img.loading = 'lazy';
+            img.decoding = 'async';
+            if (item.type === 'video') {
+                img.src = item.poster || this.manifest.placeholder;
+            } else {
+                if (item.srcset) {
+                    img.srcset = item.srcset;
+                    img.sizes = this.manifest.sizes;
+                }
+                img.src = item.src || item.url;
+                if (item.width && item.height) {
+                    img.width = item.width;
+                    img.height = item.height;
+                }
+            }
+            thumbnail.appendChild(img);
+            if (item.lqip) {
+                thumbnail.dataset.placeholder = '';
+                thumbnail.style.backgroundImage = `url(${item.lqip})`;
+                watchPlaceholder(thumbnail);
+            }
+            
+            const info = document.createElement('div');
+            info.className = 'album-info';
+            const title = document.createElement('h3');
+            title.className = 'album-title';
+            title.textContent = item.name;
+            const date = document.createElement('p');
+            date.className = 'album-count';
+            date.textContent = item.duration ? `${item.date} · ${item.duration}` : item.date;
+            info.append(title, date);
+            
+            link.append(thumbnail, info);
+            card.appendChild(link);
+            return card;
+        }
+    }
+    
     // 分页类
     class Pagination {
         constructor(totalItems, itemsPerPage) {